@@ -3,21 +3,25 @@
 from .pipeline import Pipeline
 from .config import PipelineConfig
 from .openai_client import OpenAIClient
-from .graph_builder import GraphBuilder
+from .graph_builder import GraphBuffer, GraphBuilder, NodeType
 from .extractors import StandpointExtractor, ArgumentExtractor
 from .output_manager import OutputManager
-from .parallel_utils import BatchProcessor, ProgressTracker, parallel_map, rate_limit
+from .parallel_utils import BatchProcessor, ProgressTracker, RateLimiter, parallel_map, parallel_map_async, rate_limit
 
 __all__ = [
     'Pipeline',
     'PipelineConfig', 
     'OpenAIClient',
     'GraphBuilder',
+    'GraphBuffer',
+    'NodeType',
     'StandpointExtractor',
     'ArgumentExtractor',
     'OutputManager',
     'BatchProcessor',
     'ProgressTracker',
+    'RateLimiter',
     'parallel_map',
+    'parallel_map_async',
     'rate_limit'
 ]
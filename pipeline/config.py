@@ -1,5 +1,8 @@
 """Configuration module for the pipeline"""
 
+import os
+from typing import Any, Dict
+
 
 class PipelineConfig:
     """Configuration class for pipeline settings"""
@@ -10,11 +13,23 @@ class PipelineConfig:
             'supporting_arguments': 'asst_mcGhHVlmMMnlpjMt6ReFRjTj',
             'node_aggregator': 'asst_H8KYznUzdaBPsujS0qjsdO2S'
         }
+        # Model, instructions, sampling parameters, response format and tools per assistant ID, fetched once and cached on disk
+        self.assistant_specs: Dict[str, Dict[str, Any]] = {}
+        self.assistant_cache_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'assistant_cache.json')
         self.topics = ['Formueskatt']
         self.recursion_limit = 3
         self.timeout_seconds = 300
+        self.aggregation_min_similarity = 0.2  # Skip aggregation unless two node names reach this word-set Jaccard similarity
         
         # Parallel processing configuration
-        self.max_workers = 4  # Number of concurrent threads
+        self.max_workers = 32  # Max in-flight OpenAI requests, shared by all topic/standpoint/argument coroutines
         self.enable_parallel = True  # Enable/disable parallel processing
         self.batch_size = 10  # Process standpoints in batches for memory management
+        self.argument_batch_size = 1  # Arguments answered per supporting-arguments query; above 1 uses a batched prompt the assistant's instructions don't describe
+        self.use_tree_extraction = False  # Fetch each standpoint's whole argument tree (recursion_limit levels) in one query; uses a tree prompt the supporting_arguments assistant's instructions don't describe
+        self.stream_arguments = False  # Stream responses and start child queries as each argument arrives (one argument per query)
+        self.use_batch_api = False  # Route non-interactive requests through the Batch API
+        self.response_cache_size = 1024  # Identical queries answered from an in-memory LRU of this many responses; 0 disables
+        self.response_cache_dir = None  # Directory for a persistent response cache (requires diskcache); argument prompts embed per-run node IDs, so only standpoint and aggregation queries hit across runs
+        self.requests_per_minute = 500  # OpenAI request rate limit
+        self.tokens_per_minute = 200000  # OpenAI token rate limit
@@ -1,38 +1,350 @@
 """Data processing module for parsing and transforming responses"""
 
-import json
-from typing import List, Optional
-
-
-class DataProcessor:
-    """Handles data processing and transformation"""
-    
-    @staticmethod
-    def parse_standpoints_response(response: str) -> List[str]:
-        """Parse standpoints from assistant response"""
-        if response is None or response.startswith("Error:"):
-            print(f"Assistant query failed: {response}")
-            return []
-
-        try:
-            parsed_data = json.loads(response)
-            return parsed_data['standpoints']
-        except json.JSONDecodeError as e:
-            print(f"Error parsing JSON: {e}")
-            print(f"Raw response: {response}")
-            return []
-    
-    @staticmethod
-    def parse_supporting_arguments_response(response: str) -> Optional[List[str]]:
-        """Parse supporting arguments from assistant response"""
-        if response is None or response.startswith("Error:"):
-            print(f"Assistant query failed: {response}")
-            return None
-
-        try:
-            parsed_data = json.loads(response)
-            return parsed_data['new_supporting_arguments'], parsed_data['existing_supporting_arguments']
-        except json.JSONDecodeError as e:
-            print(f"Error parsing JSON: {e}")
-            print(f"Raw response: {response}")
-            return None
+import logging
+import orjson
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    import simdjson
+except ImportError:  # Fall back to fully decoding with orjson
+    simdjson = None
+
+logger = logging.getLogger(__name__)
+
+
+def _loads_lazy(response: str) -> Any:
+    """Parse JSON into lazily materialized simdjson proxies when available, otherwise decode with orjson"""
+    if simdjson is None:
+        return orjson.loads(response)
+    # A fresh parser per document so live proxies from earlier responses stay valid
+    return simdjson.Parser().parse(response.encode('utf-8'))
+
+
+def _is_error(response: Optional[str]) -> bool:
+    """Check whether a query returned no response or an error message"""
+    return response is None or response.startswith("Error:")
+
+
+def _is_object(value: Any) -> bool:
+    """Check for a JSON object, decoded by orjson or as a simdjson proxy"""
+    return isinstance(value, dict) or (simdjson is not None and isinstance(value, simdjson.Object))
+
+
+def _is_list(value: Any) -> bool:
+    """Check for a JSON array, decoded by orjson or as a simdjson proxy"""
+    return isinstance(value, list) or (simdjson is not None and isinstance(value, simdjson.Array))
+
+
+def _field(value: Any, key: str) -> Any:
+    """Get a key from a JSON object, or None if it is missing or value is not an object"""
+    if not _is_object(value):
+        return None
+    try:
+        return value[key]
+    except KeyError:
+        return None
+
+
+def _valid_argument(argument: Any) -> Optional[Dict[str, str]]:
+    """Get {'argument', 'type'} from an argument object with non-empty string fields, or None"""
+    text, node_type = _field(argument, 'argument'), _field(argument, 'type')
+    if isinstance(text, str) and text and isinstance(node_type, str) and node_type:
+        return {'argument': text, 'type': node_type}
+    return None
+
+
+def valid_supporting_arguments(arguments: Any) -> List[Dict[str, str]]:
+    """Keep the well-formed {'argument', 'type'} entries of a new supporting arguments array, logging the rest"""
+    if arguments is None:
+        return []
+    if not _is_list(arguments):
+        logger.warning(f"Skipping supporting arguments that are not a list: {arguments}")
+        return []
+    valid = []
+    for argument in arguments:
+        parsed = _valid_argument(argument)
+        if parsed is None:
+            logger.warning(f"Skipping malformed supporting argument: {argument}")
+        else:
+            valid.append(parsed)
+    return valid
+
+
+def valid_existing_arguments(argument_ids: Any) -> List[str]:
+    """Keep the string IDs of an existing supporting arguments array, logging the rest"""
+    if argument_ids is None:
+        return []
+    if not _is_list(argument_ids):
+        logger.warning(f"Skipping existing arguments that are not a list: {argument_ids}")
+        return []
+    valid = []
+    for argument_id in argument_ids:
+        if isinstance(argument_id, str) and argument_id:
+            valid.append(argument_id)
+        else:
+            logger.warning(f"Skipping malformed existing argument ID: {argument_id}")
+    return valid
+
+
+def _supporting_arguments(parsed: Any) -> Optional[Tuple[List[Dict[str, str]], List[str]]]:
+    """Extract the validated new and existing supporting arguments from one parsed result object"""
+    if not _is_object(parsed):
+        return None
+    return (valid_supporting_arguments(_field(parsed, 'new_supporting_arguments')),
+            valid_existing_arguments(_field(parsed, 'existing_supporting_arguments')))
+
+
+def parse_standpoints_response(response: str) -> List[str]:
+    """Parse standpoints from assistant response
+
+    A response without a standpoints list gives no standpoints, and non-string entries are skipped.
+    """
+    if _is_error(response):
+        logger.error(f"Assistant query failed: {response}")
+        return []
+
+    try:
+        parsed_data = orjson.loads(response)
+    except orjson.JSONDecodeError as e:
+        logger.error(f"Error parsing JSON: {e}")
+        logger.error(f"Raw response: {response}")
+        return []
+
+    standpoints = _field(parsed_data, 'standpoints')
+    if not _is_list(standpoints):
+        logger.error(f"Standpoints response has no standpoints list: {response}")
+        return []
+    valid = []
+    for standpoint in standpoints:
+        if isinstance(standpoint, str) and standpoint:
+            valid.append(standpoint)
+        else:
+            logger.warning(f"Skipping malformed standpoint: {standpoint}")
+    return valid
+
+
+def parse_supporting_arguments_response(response: str) -> Optional[Tuple[List[Dict[str, str]], List[str]]]:
+    """Parse new and existing supporting arguments from assistant response
+
+    Malformed entries are skipped, so only well-formed arguments and IDs are returned.
+    """
+    if _is_error(response):
+        logger.error(f"Assistant query failed: {response}")
+        return None
+
+    try:
+        parsed_data = _loads_lazy(response)
+    except ValueError as e:
+        logger.error(f"Error parsing JSON: {e}")
+        logger.error(f"Raw response: {response}")
+        return None
+
+    result = _supporting_arguments(parsed_data)
+    if result is None:
+        logger.error(f"Supporting arguments response is not a JSON object: {response}")
+    return result
+
+
+def parse_supporting_arguments_batch_response(response: str, count: int) -> List[Optional[Tuple[List[Dict[str, str]], List[str]]]]:
+    """Parse a batched supporting arguments response into one result per numbered argument
+
+    Arguments missing from the response, or with a malformed entry, get None like a failed single query.
+    """
+    results: List[Optional[Tuple[List[Dict[str, str]], List[str]]]] = [None] * count
+    if _is_error(response):
+        logger.error(f"Assistant query failed: {response}")
+        return results
+
+    try:
+        parsed_data = _loads_lazy(response)
+    except ValueError as e:
+        logger.error(f"Error parsing batched response: {e}")
+        logger.error(f"Raw response: {response}")
+        return results
+
+    entries = _field(parsed_data, 'results')
+    if not _is_list(entries):
+        logger.error(f"Batched response has no results list: {response}")
+        return results
+    for entry in entries:
+        number = _field(entry, 'argument_number')
+        if isinstance(number, int) and not isinstance(number, bool) and 1 <= number <= count:
+            results[number - 1] = _supporting_arguments(entry)
+        else:
+            logger.warning(f"Skipping batched result with invalid argument_number: {number}")
+
+    missing = results.count(None)
+    if missing:
+        logger.error(f"Batched response is missing {missing} of {count} arguments")
+    return results
+
+
+def _valid_tree(nodes: Any) -> List[Dict[str, Any]]:
+    """Keep the well-formed nodes of an argument tree level, recursively, logging the rest"""
+    if nodes is None:
+        return []
+    if not _is_list(nodes):
+        logger.warning(f"Skipping argument tree level that is not a list: {nodes}")
+        return []
+    valid = []
+    for node in nodes:
+        argument = _valid_argument(node)
+        if argument is None:
+            logger.warning(f"Skipping malformed tree argument: {node}")
+            continue
+        is_parent = argument['type'] == 'argument'
+        argument['existing'] = valid_existing_arguments(_field(node, 'existing')) if is_parent else []
+        argument['children'] = _valid_tree(_field(node, 'children')) if is_parent else []
+        valid.append(argument)
+    return valid
+
+
+def parse_argument_tree_response(response: str) -> Optional[Tuple[List[Dict[str, Any]], List[str]]]:
+    """Parse the nested supporting argument tree and the root's existing argument IDs from assistant response
+
+    Every returned node has string 'argument' and 'type' and list 'existing' and 'children';
+    malformed nodes are skipped with their subtrees.
+    """
+    if _is_error(response):
+        logger.error(f"Assistant query failed: {response}")
+        return None
+
+    try:
+        parsed_data = orjson.loads(response)
+    except ValueError as e:
+        logger.error(f"Error parsing argument tree: {e}")
+        logger.error(f"Raw response: {response}")
+        return None
+
+    if not _is_object(parsed_data):
+        logger.error(f"Argument tree response is not a JSON object: {response}")
+        return None
+    return _valid_tree(_field(parsed_data, 'arguments')), valid_existing_arguments(_field(parsed_data, 'existing'))
+
+
+def _valid_merge_group(group: Any) -> Optional[Dict[str, Any]]:
+    """Get {'original_ids', 'new_argument', 'node_type'} from a merge group naming at least two distinct node IDs, or None"""
+    original_ids = _field(group, 'original_ids')
+    new_argument = _field(group, 'new_argument')
+    node_type = _field(group, 'node_type')
+    if node_type is None:
+        node_type = 'supporting_argument'  # Default fallback
+    if not (_is_list(original_ids) and isinstance(new_argument, str) and new_argument
+            and isinstance(node_type, str) and node_type):
+        return None
+    if not all(isinstance(node_id, str) and node_id for node_id in original_ids):
+        return None
+    ids = list(dict.fromkeys(original_ids))
+    if len(ids) < 2:
+        return None
+    return {'original_ids': ids, 'new_argument': new_argument, 'node_type': node_type}
+
+
+def parse_aggregation_response(response: str) -> Optional[List[Dict[str, Any]]]:
+    """Parse merged node groups from the aggregation assistant response
+
+    Malformed groups are skipped, so every returned group has at least two distinct
+    string 'original_ids' and string 'new_argument' and 'node_type'.
+    """
+    if _is_error(response):
+        logger.error(f"LLM assistant error: {response}")
+        return None
+
+    try:
+        parsed_data = _loads_lazy(response)
+    except ValueError as e:
+        logger.error(f"Failed to parse LLM response as JSON: {e}")
+        logger.error(f"Raw response: {response}")
+        return None
+
+    if not _is_object(parsed_data):
+        logger.error(f"Aggregation response is not a JSON object: {response}")
+        return None
+    groups = _field(parsed_data, 'merged_nodes')
+    if groups is None:
+        return []
+    if not _is_list(groups):
+        logger.error(f"Aggregation response merged_nodes is not a list: {response}")
+        return None
+    valid = []
+    for group in groups:
+        parsed = _valid_merge_group(group)
+        if parsed is None:
+            logger.warning(f"Skipping malformed merge group: {group}")
+        else:
+            valid.append(parsed)
+    return valid
+
+
+class StreamingJsonParser:
+    """Incrementally scans a streamed JSON object and yields array elements as soon as they are complete
+
+    Only object and string elements of top-level arrays under the given keys are
+    yielded. Text outside the top-level object, such as a markdown fence, is skipped.
+    """
+
+    def __init__(self, keys: Iterable[str]):
+        self.keys = set(keys)
+        self._buffer = ''
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_key: Optional[str] = None
+        self._array_key: Optional[str] = None
+        self._element_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Consume the next chunk of text and return (key, element) for every element completed by it"""
+        self._buffer += chunk
+        buffer = self._buffer
+        completed = []
+
+        for pos in range(self._pos, len(buffer)):
+            char = buffer[pos]
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_key = orjson.loads(buffer[self._string_start:pos + 1])
+                    elif self._depth == 2 and self._array_key is not None and self._element_start is None:
+                        completed.append((self._array_key, orjson.loads(buffer[self._string_start:pos + 1])))
+                continue
+
+            if char == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif char in '{[':
+                if self._depth == 1 and char == '[' and self._last_key in self.keys:
+                    self._array_key = self._last_key
+                elif self._depth == 2 and self._array_key is not None:
+                    self._element_start = pos
+                self._depth += 1
+            elif char in '}]' and self._depth > 0:
+                self._depth -= 1
+                if self._depth == 2 and self._element_start is not None:
+                    completed.append((self._array_key, orjson.loads(buffer[self._element_start:pos + 1])))
+                    self._element_start = None
+                elif self._depth == 1:
+                    self._array_key = None
+
+        # Keep only the unfinished element or string, so the buffer stays small
+        # however long the stream is
+        if self._element_start is not None:
+            consumed = self._element_start
+        elif self._in_string:
+            consumed = self._string_start
+        else:
+            consumed = len(buffer)
+        self._buffer = buffer[consumed:]
+        if self._element_start is not None:
+            self._element_start -= consumed
+        self._string_start -= consumed
+        self._pos = len(self._buffer)
+        return completed
@@ -1,12 +1,25 @@
 """Extractors module for extracting standpoints and arguments"""
 
+import asyncio
+import logging
+from contextlib import aclosing
 import prompts
-from typing import List
+from typing import Any, List, Optional, Tuple
 from config import PipelineConfig
 from openai_client import OpenAIClient
-from data_processor import DataProcessor
+from data_processor import (
+    parse_standpoints_response,
+    parse_supporting_arguments_response,
+    parse_supporting_arguments_batch_response,
+    parse_argument_tree_response,
+    valid_existing_arguments,
+    valid_supporting_arguments,
+    StreamingJsonParser
+)
 from graph_builder import GraphBuilder
 
+logger = logging.getLogger(__name__)
+
 
 class StandpointExtractor:
     """Extracts standpoints for topics"""
@@ -14,15 +27,22 @@ class StandpointExtractor:
     def __init__(self, openai_client: OpenAIClient, config: PipelineConfig):
         self.openai_client = openai_client
         self.config = config
-        self.data_processor = DataProcessor()
     
-    def extract_standpoints(self, topic: str) -> List[str]:
+    async def extract_standpoints(self, topic: str) -> List[str]:
         """Extract standpoints for a given topic"""
         prompt = prompts.GET_STANDPOINTS_PROMPT(topic)
         assistant_id = self.config.assistant_ids['standpoints']
         
-        response = self.openai_client.query_assistant(assistant_id, prompt)
-        return self.data_processor.parse_standpoints_response(response)
+        response = await self.openai_client.query_assistant(assistant_id, prompt)
+        return parse_standpoints_response(response)
+    
+    async def extract_standpoints_batch(self, topics: List[str]) -> List[List[str]]:
+        """Extract standpoints for several topics in a single Batch API request"""
+        assistant_id = self.config.assistant_ids['standpoints']
+        prompt_pairs = [(assistant_id, prompts.GET_STANDPOINTS_PROMPT(topic)) for topic in topics]
+        
+        responses = await self.openai_client.query_batch(prompt_pairs)
+        return [parse_standpoints_response(response) for response in responses]
 
 
 class ArgumentExtractor:
@@ -31,24 +51,179 @@ class ArgumentExtractor:
     def __init__(self, openai_client: OpenAIClient, config: PipelineConfig):
         self.openai_client = openai_client
         self.config = config
-        self.data_processor = DataProcessor()
     
-    def extract_arguments(self, parent_argument: str, parent_argument_id: str, graph_builder: GraphBuilder, recursion_level: int = 0):
-        """Extract supporting arguments recursively"""
+    async def extract_arguments(self, parent_argument: str, parent_argument_id: str, graph_builder: GraphBuilder, recursion_level: int = 0):
+        """Extract supporting arguments for a single argument"""
+        await self.extract_arguments_batch([(parent_argument, parent_argument_id)], graph_builder, recursion_level)
+    
+    async def extract_arguments_batch(self, arguments: List[Tuple[str, str]], graph_builder: GraphBuilder, recursion_level: int = 0):
+        """Extract supporting arguments for several (argument, argument_id) pairs breadth-first
+        
+        Each level is split into chunks of config.argument_batch_size arguments, and every
+        chunk is answered by one query. With config.use_tree_extraction, each argument's
+        whole subtree comes from a single query. With config.stream_arguments, each argument is
+        instead streamed on its own and child queries start as soon as they arrive.
+        """
+        if self.config.use_tree_extraction:
+            results = await asyncio.gather(*[
+                self.extract_tree(argument, argument_id, graph_builder, self.config.recursion_limit - recursion_level)
+                for argument, argument_id in arguments
+            ], return_exceptions=True)
+            for (argument, _), result in zip(arguments, results):
+                if isinstance(result, Exception):
+                    logger.error(f"Tree extraction failed for argument {argument[:50]}...: {result}")
+            return
+        
+        if self.config.stream_arguments:
+            await asyncio.gather(*[
+                self._extract_streaming(argument, argument_id, graph_builder, recursion_level)
+                for argument, argument_id in arguments
+            ])
+            return
+        
+        frontier = list(arguments)
+        
+        for _ in range(recursion_level, self.config.recursion_limit):
+            if not frontier:
+                break
+            
+            results = await self._query_level(frontier, graph_builder)
+            
+            # Add the whole level to the graph in one flush
+            buffer = graph_builder.buffer()
+            next_frontier = []
+            for (_, parent_id), parsed in zip(frontier, results):
+                if parsed is None:
+                    continue
+                # The parsers only return well-formed entries, so one bad response loses only its own parent
+                new_supporting_arguments, existing_supporting_arguments = parsed
+                
+                argument_ids = buffer.add_supporting_arguments(new_supporting_arguments, parent_id)
+                for argument, argument_id in zip(new_supporting_arguments, argument_ids):
+                    if (argument['type'] == 'argument'):
+                        next_frontier.append((argument['argument'], argument_id))
+                for argument in existing_supporting_arguments:
+                    buffer.add_existing_supporting_argument(argument, parent_id)
+            buffer.flush()
+            
+            frontier = next_frontier
+    
+    async def extract_tree(self, parent_argument: str, parent_argument_id: str, graph_builder: GraphBuilder, depth: int):
+        """Extract a whole supporting argument tree, depth levels deep, with one query and add it to the graph"""
+        if depth <= 0:
+            return
+        
+        assistant_id = self.config.assistant_ids['supporting_arguments']
+        prompt = prompts.GET_ARGUMENT_TREE_PROMPT(parent_argument, graph_builder.get_existing_arguments(parent_argument_id), depth)
+        try:
+            response = await self.openai_client.query_assistant(assistant_id, prompt)
+        except Exception as e:
+            logger.error(f"Tree query failed for argument {parent_argument[:50]}...: {e}")
+            return
+        parsed = parse_argument_tree_response(response)
+        if parsed is None:
+            return
+        tree, existing_supporting_arguments = parsed
+        
+        # Walk the validated tree locally and add it to the graph in one flush
+        buffer = graph_builder.buffer()
+        for argument in existing_supporting_arguments:
+            buffer.add_existing_supporting_argument(argument, parent_argument_id)
+        stack = [(tree, parent_argument_id, 1)]
+        while stack:
+            arguments, parent_id, level = stack.pop()
+            argument_ids = buffer.add_supporting_arguments(arguments, parent_id)
+            for argument, argument_id in zip(arguments, argument_ids):
+                for existing_id in argument['existing']:
+                    buffer.add_existing_supporting_argument(existing_id, argument_id)
+                if argument['children'] and level < depth:
+                    stack.append((argument['children'], argument_id, level + 1))
+        buffer.flush()
+    
+    async def _extract_streaming(self, parent_argument: str, parent_argument_id: str, graph_builder: GraphBuilder, recursion_level: int):
+        """Stream the supporting arguments of one argument, starting each child extraction as soon as it is parsed"""
         if recursion_level >= self.config.recursion_limit:
             return
         
+        assistant_id = self.config.assistant_ids['supporting_arguments']
         prompt = prompts.GET_SUPPORTING_ARGUMENTS_PROMPT(parent_argument, graph_builder.get_existing_arguments(parent_argument_id))
+        parser = StreamingJsonParser(['new_supporting_arguments', 'existing_supporting_arguments'])
+        children = []
+        
+        async def consume_stream():
+            async with aclosing(self.openai_client.stream_assistant(assistant_id, prompt)) as deltas:
+                async for delta in deltas:
+                    for key, element in parser.feed(delta):
+                        if key == 'existing_supporting_arguments':
+                            for argument in valid_existing_arguments([element]):
+                                graph_builder.add_existing_supporting_argument(argument, parent_argument_id)
+                            continue
+                        for argument in valid_supporting_arguments([element]):
+                            argument_id = graph_builder.add_supporting_argument(argument['argument'], argument['type'], parent_argument_id)
+                            if (argument['type'] == 'argument'):
+                                children.append(asyncio.create_task(
+                                    self._extract_streaming(argument['argument'], argument_id, graph_builder, recursion_level + 1)
+                                ))
+        
+        try:
+            await asyncio.wait_for(consume_stream(), timeout=self.config.timeout_seconds)
+        except asyncio.TimeoutError:
+            logger.error(f"Streaming timeout after {self.config.timeout_seconds} seconds for argument: {parent_argument[:50]}...")
+        except Exception as e:
+            logger.error(f"Streaming query failed for argument {parent_argument[:50]}...: {e}")
+        
+        # Arguments parsed before a failure are kept, and their subtrees still complete
+        await asyncio.gather(*children)
+    
+    async def _query_level(self, frontier: List[Tuple[str, str]], graph_builder: GraphBuilder) -> List[Optional[Tuple[List[Any], List[str]]]]:
+        """Query one level in chunks, through the Batch API if enabled, and return parsed results in frontier order"""
         assistant_id = self.config.assistant_ids['supporting_arguments']
+        batch_size = max(1, self.config.argument_batch_size)
+        chunks = [frontier[i:i + batch_size] for i in range(0, len(frontier), batch_size)]
+        
+        chunk_prompts = []
+        chunk_allowed_ids = []
+        for chunk in chunks:
+            if len(chunk) == 1:
+                argument, argument_id = chunk[0]
+                chunk_prompts.append(prompts.GET_SUPPORTING_ARGUMENTS_PROMPT(argument, graph_builder.get_existing_arguments(argument_id)))
+                chunk_allowed_ids.append(None)
+                continue
+            
+            # List the union of the arguments' existing pools once, and per argument only the
+            # IDs it may not reuse (its own ancestors)
+            pools = [graph_builder.get_existing_arguments(argument_id) for _, argument_id in chunk]
+            shared_pool = list({node['id']: node for pool in pools for node in pool}.values())
+            allowed_ids = [{node['id'] for node in pool} for pool in pools]
+            chunk_prompts.append(prompts.GET_SUPPORTING_ARGUMENTS_BATCH_PROMPT(
+                [
+                    (argument, [node['id'] for node in shared_pool if node['id'] not in allowed])
+                    for (argument, _), allowed in zip(chunk, allowed_ids)
+                ],
+                shared_pool
+            ))
+            chunk_allowed_ids.append(allowed_ids)
+        
+        if self.config.use_batch_api:
+            responses = await self.openai_client.query_batch([(assistant_id, prompt) for prompt in chunk_prompts])
+        else:
+            responses = await asyncio.gather(
+                *[self.openai_client.query_assistant(assistant_id, prompt) for prompt in chunk_prompts],
+                return_exceptions=True
+            )
         
-        response = self.openai_client.query_assistant(assistant_id, prompt)
-        new_supporting_arguments, existing_supporting_arguments = self.data_processor.parse_supporting_arguments_response(response)
-        
-        if new_supporting_arguments is not None:
-            for argument in new_supporting_arguments:
-                argument_id = graph_builder.add_supporting_argument(argument['argument'], argument['type'], parent_argument_id)
-                if (argument['type'] == 'argument'):
-                    self.extract_arguments(argument['argument'], argument_id, graph_builder, recursion_level + 1)
-        if existing_supporting_arguments is not None:
-            for argument in existing_supporting_arguments:
-                argument_id = graph_builder.add_existing_supporting_argument(argument, parent_argument_id)
+        results = []
+        for chunk, allowed_ids, response in zip(chunks, chunk_allowed_ids, responses):
+            if isinstance(response, Exception):
+                # A failed chunk only loses its own arguments, not the whole level
+                response = f"Error: {response}"
+            if len(chunk) == 1:
+                results.append(parse_supporting_arguments_response(response))
+                continue
+            for parsed, allowed in zip(parse_supporting_arguments_batch_response(response, len(chunk)), allowed_ids):
+                if parsed is not None:
+                    # Drop reused IDs outside the argument's own pool, which could create cycles
+                    new_supporting_arguments, existing_supporting_arguments = parsed
+                    parsed = new_supporting_arguments, [argument_id for argument_id in existing_supporting_arguments if argument_id in allowed]
+                results.append(parsed)
+        return results
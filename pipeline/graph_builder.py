@@ -1,83 +1,302 @@
 """Graph builder module for constructing and managing graph structures"""
 
-import uuid
+import itertools
+import orjson
+import re
+import sys
 import threading
-from typing import List, Dict, Any
+import uuid
+from array import array
+from collections import Counter, defaultdict, deque
+from enum import IntEnum
+from typing import List, Dict, Any, BinaryIO, Iterable
+
+
+class NodeType(IntEnum):
+    """Node type codes stored in GraphBuilder's type array; unknown types get new codes on demand"""
+    TOPIC = 0
+    STANDPOINT = 1
+    ARGUMENT = 2
+    FACT = 3
+    VALUE = 4
+
+
+# Node types that the aggregation assistant may merge
+AGGREGATABLE_TYPES = (NodeType.ARGUMENT, NodeType.FACT, NodeType.VALUE)
+
+_WORD_RE = re.compile(r'\w+')
+
+# Type codes are stored in an array('H')
+_MAX_TYPE_CODE = 0xFFFF
+
+
+def has_merge_candidates(nodes: List[Dict[str, Any]], min_similarity: float = 0.2) -> bool:
+    """Check whether any two node names reach min_similarity Jaccard similarity of their word sets
+    
+    Only pairs sharing at least one word are compared, and the check stops at the first match.
+    """
+    token_sets = [frozenset(_WORD_RE.findall(node['name'].lower())) for node in nodes]
+    nodes_by_token: Dict[str, List[int]] = defaultdict(list)
+    for i, tokens in enumerate(token_sets):
+        seen = set()
+        for token in tokens:
+            for j in nodes_by_token[token]:
+                if j in seen:
+                    continue
+                seen.add(j)
+                other = token_sets[j]
+                if len(tokens & other) / len(tokens | other) >= min_similarity:
+                    return True
+            nodes_by_token[token].append(i)
+    return False
 
 
 class GraphBuilder:
     """Builds the graph structure with nodes and edges in a thread-safe manner"""
     
     def __init__(self):
-        self.nodes: List[Dict[str, Any]] = []
+        # Nodes are stored as parallel arrays (struct of arrays) instead of one dict per node
+        self._node_ids: List[str] = []
+        self._node_names: List[str] = []
+        self._node_types = array('H')
+        self._type_names: List[str] = [sys.intern(node_type.name.lower()) for node_type in NodeType]
+        self._type_codes: Dict[str, int] = {name: code for code, name in enumerate(self._type_names)}
         self.edges: List[Dict[str, Any]] = []
-        self._lock = threading.Lock()  # Thread safety lock
+        # Separate locks so node and edge writers don't contend; take _nodes_lock first when both are needed
+        self._nodes_lock = threading.Lock()
+        self._edges_lock = threading.Lock()
+        # Indexes kept in sync with nodes/edges for fast traversal
+        self._out_edges: Dict[str, List[str]] = defaultdict(list)
+        self._node_index: Dict[str, int] = {}
+        # Per-type counts and insertion-ordered ID sets, maintained on every node add/remove
+        self._type_counts: Counter = Counter()
+        self._ids_by_type: Dict[int, Dict[str, None]] = defaultdict(dict)
+        # IDs are a per-run random prefix plus a counter, so graphs from different runs never share IDs
+        self._run_prefix = uuid.uuid4().hex[:8]
+        self._id_counter = itertools.count()
+    
+    @property
+    def nodes(self) -> List[Dict[str, Any]]:
+        """Snapshot of all nodes as dicts"""
+        with self._nodes_lock:
+            return self._node_dicts(range(len(self._node_ids)))
     
     def add_topic(self, topic: str) -> str:
         """Add a topic node and return its ID"""
         topic_id = self._generate_id()
-        with self._lock:
-            self.nodes.append({'id': topic_id, 'name': topic, 'type': 'topic'})
+        with self._nodes_lock:
+            self._append_node(topic_id, topic, 'topic')
         return topic_id
     
     def add_standpoint(self, standpoint: str, topic_id: str) -> str:
         """Add a standpoint node and connect it to topic"""
         standpoint_id = self._generate_id()
-        with self._lock:
-            self.nodes.append({'id': standpoint_id, 'name': standpoint, 'type': 'standpoint'})
+        with self._nodes_lock:
+            self._append_node(standpoint_id, standpoint, 'standpoint')
+        with self._edges_lock:
             # Fix: Standpoint should point TO topic (standpoint supports/explains the topic)
-            self.edges.append({'source': standpoint_id, 'target': topic_id, 'type': 'standpoint_to_topic'})
+            self._append_edge({'source': standpoint_id, 'target': topic_id, 'type': 'standpoint_to_topic'})
         return standpoint_id
     
     def add_supporting_argument(self, argument: str, type: str,parent_id: str) -> str:
         """Add a supporting argument node and connect it to parent"""
         argument_id = self._generate_id()
-        with self._lock:
-            self.nodes.append({'id': argument_id, 'name': argument, 'type': type})
+        with self._nodes_lock:
+            self._append_node(argument_id, argument, type)
+        with self._edges_lock:
             # Fix: Supporting argument should point TO the node it supports
-            self.edges.append({'source': argument_id, 'target': parent_id, 'type': 'supports'})
+            self._append_edge({'source': argument_id, 'target': parent_id, 'type': 'supports'})
         return argument_id
     
+    def add_standpoints(self, standpoints: List[str], topic_id: str) -> List[str]:
+        """Add several standpoint nodes connected to a topic, taking each lock once"""
+        standpoint_ids = [self._generate_id() for _ in standpoints]
+        with self._nodes_lock:
+            self._extend_nodes(standpoint_ids, standpoints, ['standpoint'] * len(standpoints))
+        with self._edges_lock:
+            self._extend_edges([
+                {'source': standpoint_id, 'target': topic_id, 'type': 'standpoint_to_topic'}
+                for standpoint_id in standpoint_ids
+            ])
+        return standpoint_ids
+    
+    def buffer(self) -> 'GraphBuffer':
+        """Create a buffer that collects nodes and edges for one task and adds them in a single flush"""
+        return GraphBuffer(self)
+    
     def add_existing_supporting_argument(self, argument_id: str, parent_id: str) -> str:
         """Add a supporting argument node and connect it to parent"""
-        with self._lock:
+        with self._edges_lock:
             # Fix: Supporting argument should point TO the node it supports
-            self.edges.append({'source': argument_id, 'target': parent_id, 'type': 'supports'})
+            self._append_edge({'source': argument_id, 'target': parent_id, 'type': 'supports'})
         return argument_id
     
+    def load_graph_data(self, graph_data: Dict[str, Any]) -> None:
+        """Replace the graph contents with previously saved graph data"""
+        with self._nodes_lock, self._edges_lock:
+            nodes = graph_data.get('nodes', [])
+            self._node_ids = [node['id'] for node in nodes]
+            self._node_names = [node['name'] for node in nodes]
+            self._node_types = array('H', [self._type_code(node['type']) for node in nodes])
+            self._node_index = {node_id: i for i, node_id in enumerate(self._node_ids)}
+            self._type_counts = Counter(self._node_types)
+            self._ids_by_type = defaultdict(dict)
+            for node_id, code in zip(self._node_ids, self._node_types):
+                self._ids_by_type[code][node_id] = None
+            self.edges = list(graph_data.get('edges', []))
+            self._rebuild_edge_index()
+    
+    def _type_code(self, node_type: str) -> int:
+        """Get the integer code for a node type, registering new types (_nodes_lock must be held)"""
+        code = self._type_codes.get(node_type)
+        if code is None:
+            code = len(self._type_names)
+            if code > _MAX_TYPE_CODE:
+                raise ValueError(f"Too many node types to add {node_type!r}: at most {_MAX_TYPE_CODE + 1} are supported")
+            node_type = sys.intern(node_type)
+            self._type_names.append(node_type)
+            self._type_codes[node_type] = code
+        return code
+    
+    def _node_dicts(self, indices: Iterable[int]) -> List[Dict[str, Any]]:
+        """Materialize the nodes at the given positions as dicts (_nodes_lock must be held)"""
+        return [
+            {'id': self._node_ids[i], 'name': self._node_names[i], 'type': self._type_names[self._node_types[i]]}
+            for i in indices
+        ]
+    
+    def _append_node(self, node_id: str, name: str, node_type: str) -> None:
+        """Append a node and index it (_nodes_lock must be held)"""
+        code = self._type_code(node_type)
+        self._node_index[node_id] = len(self._node_ids)
+        self._node_ids.append(node_id)
+        self._node_names.append(name)
+        self._node_types.append(code)
+        self._type_counts[code] += 1
+        self._ids_by_type[code][node_id] = None
+    
+    def _extend_nodes(self, node_ids: List[str], names: List[str], node_types: List[str]) -> None:
+        """Append several nodes and index them (_nodes_lock must be held)"""
+        codes = [self._type_code(node_type) for node_type in node_types]
+        start = len(self._node_ids)
+        self._node_index.update(zip(node_ids, range(start, start + len(node_ids))))
+        self._node_ids.extend(node_ids)
+        self._node_names.extend(names)
+        self._node_types.extend(codes)
+        self._type_counts.update(codes)
+        for node_id, code in zip(node_ids, codes):
+            self._ids_by_type[code][node_id] = None
+    
+    def _flush_buffer(self, buffer: 'GraphBuffer') -> None:
+        """Add a buffer's nodes and edges, taking each lock once"""
+        if buffer.node_ids:
+            with self._nodes_lock:
+                self._extend_nodes(buffer.node_ids, buffer.names, buffer.node_types)
+        if buffer.edges:
+            with self._edges_lock:
+                self._extend_edges(buffer.edges)
+    
+    def _remove_node(self, node_id: str) -> None:
+        """Remove a node by swapping the last node into its slot (_nodes_lock must be held)"""
+        index = self._node_index.pop(node_id, None)
+        if index is None:
+            return
+        code = self._node_types[index]
+        self._type_counts[code] -= 1
+        del self._ids_by_type[code][node_id]
+        last = len(self._node_ids) - 1
+        if index != last:
+            moved_id = self._node_ids[last]
+            self._node_ids[index] = moved_id
+            self._node_names[index] = self._node_names[last]
+            self._node_types[index] = self._node_types[last]
+            self._node_index[moved_id] = index
+        self._node_ids.pop()
+        self._node_names.pop()
+        self._node_types.pop()
+    
+    def _append_edge(self, edge: Dict[str, Any]) -> None:
+        """Append an edge and index it (_edges_lock must be held)"""
+        self.edges.append(edge)
+        self._out_edges[edge['source']].append(edge['target'])
+    
+    def _extend_edges(self, edges: List[Dict[str, Any]]) -> None:
+        """Append several edges and index them (_edges_lock must be held)"""
+        self.edges.extend(edges)
+        for edge in edges:
+            self._out_edges[edge['source']].append(edge['target'])
+    
+    def _rebuild_edge_index(self) -> None:
+        """Rebuild the adjacency index from edges (_edges_lock must be held)"""
+        self._out_edges = defaultdict(list)
+        for edge in self.edges:
+            self._out_edges[edge['source']].append(edge['target'])
+    
     def _generate_id(self) -> str:
-        """Generate a unique UUID"""
-        return str(uuid.uuid4())
+        """Generate a unique ID from the run prefix and a monotonic counter (next() on itertools.count is atomic in CPython)"""
+        return f"{self._run_prefix}{next(self._id_counter):08x}"
     
     def get_graph_data(self) -> Dict[str, Any]:
         """Get the complete graph data"""
-        with self._lock:
-            return {'nodes': self.nodes.copy(), 'edges': self.edges.copy()}
+        with self._nodes_lock, self._edges_lock:
+            return {'nodes': self._node_dicts(range(len(self._node_ids))), 'edges': self.edges.copy()}
+        
+    def stream_to(self, fp: BinaryIO) -> None:
+        """Write the graph as JSON to a binary file, one node/edge at a time, without building the full graph dict"""
+        with self._nodes_lock, self._edges_lock:
+            fp.write(b'{"nodes":[')
+            for i in range(len(self._node_ids)):
+                if i:
+                    fp.write(b',')
+                fp.write(orjson.dumps({
+                    'id': self._node_ids[i],
+                    'name': self._node_names[i],
+                    'type': self._type_names[self._node_types[i]]
+                }))
+            fp.write(b'],"edges":[')
+            for i, edge in enumerate(self.edges):
+                if i:
+                    fp.write(b',')
+                fp.write(orjson.dumps(edge))
+            fp.write(b']}\n')
         
     def get_existing_arguments(self, parent_argument_id: str):
+        # Not memoized: each parent is queried once per level and the graph changes between levels,
+        # so a cache invalidated on every write would never hit
         
         # Find all ancestors of the parent_argument_id node
         # With corrected edge direction: supporting arguments point TO the nodes they support
-        ancestors = set()
-        to_process = [parent_argument_id]
-        
-        while to_process:
-            current_id = to_process.pop(0)
-            if current_id not in ancestors:
-                ancestors.add(current_id)
-                # Find all nodes that have edges pointing TO current_id (supporting arguments)
-                for edge in self.edges:
-                    if edge['source'] == current_id:
-                        to_process.append(edge['target'])
+        with self._edges_lock:
+            ancestors = {parent_argument_id}
+            to_process = deque([parent_argument_id])
+            
+            while to_process:
+                current_id = to_process.popleft()
+                for target_id in self._out_edges.get(current_id, ()):
+                    if target_id not in ancestors:
+                        ancestors.add(target_id)
+                        to_process.append(target_id)
         
         # Return all nodes except the ancestors
-        return [node for node in self.nodes if node['id'] not in ancestors]
+        with self._nodes_lock:
+            return self._node_dicts(i for i, node_id in enumerate(self._node_ids) if node_id not in ancestors)
     
     def aggregate_nodes(self, merged_nodes_data: List[Dict[str, Any]]) -> None:
-        """Aggregate nodes based on LLM recommendations"""
-        with self._lock:
+        """Aggregate nodes based on LLM recommendations
+
+        Unknown IDs and IDs already merged by an earlier group are ignored, and groups
+        left with fewer than two nodes are skipped.
+        """
+        with self._nodes_lock, self._edges_lock:
+            # Map every original node ID to the merged node replacing it
+            id_to_merged: Dict[str, str] = {}
             for merge_info in merged_nodes_data:
-                original_ids = merge_info.get('original_ids', [])
+                # Only nodes in the graph and not already merged by an earlier group, so
+                # every merged node replaces at least two nodes and keeps their edges
+                original_ids = [
+                    original_id for original_id in dict.fromkeys(merge_info.get('original_ids', []))
+                    if original_id in self._node_index and original_id not in id_to_merged
+                ]
                 new_argument = merge_info.get('new_argument', '')
                 node_type = merge_info.get('node_type', 'supporting_argument')  # Default fallback
                 
@@ -86,53 +305,90 @@ class GraphBuilder:
                 
                 # Create new merged node with specified type
                 merged_node_id = self._generate_id()
-                merged_node = {
-                    'id': merged_node_id,
-                    'name': new_argument,
-                    'type': node_type
-                }
-                self.nodes.append(merged_node)
-                
-                # Find all edges that reference the original nodes
-                edges_to_update = []
-                edges_to_remove = []
-                
-                for edge in self.edges:
-                    if edge['source'] in original_ids:
-                        # Update source to point to merged node (supporting argument relationship)
-                        new_edge = edge.copy()
-                        new_edge['source'] = merged_node_id
-                        edges_to_update.append(new_edge)
-                        edges_to_remove.append(edge)
-                    elif edge['target'] in original_ids:
-                        # Update target to point to merged node (supported node relationship)
-                        new_edge = edge.copy()
-                        new_edge['target'] = merged_node_id
-                        edges_to_update.append(new_edge)
-                        edges_to_remove.append(edge)
-                
-                # Remove old edges and add new ones
-                for edge in edges_to_remove:
-                    self.edges.remove(edge)
-                self.edges.extend(edges_to_update)
-                
-                # Remove original nodes
-                self.nodes = [node for node in self.nodes if node['id'] not in original_ids]
+                self._append_node(merged_node_id, new_argument, node_type)
+                for original_id in original_ids:
+                    id_to_merged[original_id] = merged_node_id
+            
+            if not id_to_merged:
+                return
+            
+            # Rewire edges to the merged nodes in a single pass, dropping edges that
+            # end up connecting a merged node to itself
+            new_edges = []
+            for edge in self.edges:
+                source = id_to_merged.get(edge['source'], edge['source'])
+                target = id_to_merged.get(edge['target'], edge['target'])
+                if source == target:
+                    continue
+                if source == edge['source'] and target == edge['target']:
+                    new_edges.append(edge)
+                else:
+                    new_edges.append({**edge, 'source': source, 'target': target})
+            self.edges = new_edges
+            
+            # Remove original nodes
+            for original_id in id_to_merged:
+                self._remove_node(original_id)
+            
+            self._rebuild_edge_index()
     
     def get_all_nodes_for_aggregation(self) -> List[Dict[str, Any]]:
         """Get all nodes formatted for the aggregation assistant"""
-        with self._lock:
+        with self._nodes_lock:
             # Return only supporting argument nodes (excluding topics and standpoints)
             # Include argument, fact, and value types
-            return [node for node in self.nodes if node['type'] in ['argument', 'fact', 'value']]
+            return self._node_dicts(
+                self._node_index[node_id] for code in AGGREGATABLE_TYPES for node_id in self._ids_by_type[code]
+            )
     
     def get_stats(self) -> Dict[str, int]:
         """Get current graph statistics"""
-        with self._lock:
-            return {
-                'total_nodes': len(self.nodes),
-                'total_edges': len(self.edges),
-                'topics': len([n for n in self.nodes if n['type'] == 'topic']),
-                'standpoints': len([n for n in self.nodes if n['type'] == 'standpoint']),
-                'arguments': len([n for n in self.nodes if n['type'] == 'supporting_argument'])
-            }
+        with self._nodes_lock:
+            type_counts = self._type_counts.copy()
+            total_nodes = len(self._node_ids)
+        with self._edges_lock:
+            total_edges = len(self.edges)
+        return {
+            'total_nodes': total_nodes,
+            'total_edges': total_edges,
+            'topics': type_counts[NodeType.TOPIC],
+            'standpoints': type_counts[NodeType.STANDPOINT],
+            'arguments': type_counts[self._type_codes.get('supporting_argument')]
+        }
+
+
+class GraphBuffer:
+    """Nodes and edges collected by one task, added to a GraphBuilder on flush()
+    
+    Node IDs are assigned immediately, so edges can refer to buffered nodes, but
+    buffered nodes are not visible in the graph until flushed.
+    """
+    
+    def __init__(self, graph_builder: GraphBuilder):
+        self.graph_builder = graph_builder
+        self.node_ids: List[str] = []
+        self.names: List[str] = []
+        self.node_types: List[str] = []
+        self.edges: List[Dict[str, Any]] = []
+    
+    def add_supporting_arguments(self, arguments: List[Dict[str, Any]], parent_id: str) -> List[str]:
+        """Buffer several {'argument', 'type'} supporting argument nodes connected to a parent"""
+        argument_ids = [self.graph_builder._generate_id() for _ in arguments]
+        self.node_ids.extend(argument_ids)
+        self.names.extend(argument['argument'] for argument in arguments)
+        self.node_types.extend(argument['type'] for argument in arguments)
+        self.edges.extend(
+            {'source': argument_id, 'target': parent_id, 'type': 'supports'}
+            for argument_id in argument_ids
+        )
+        return argument_ids
+    
+    def add_existing_supporting_argument(self, argument_id: str, parent_id: str) -> str:
+        """Buffer an edge from an existing supporting argument to a parent"""
+        self.edges.append({'source': argument_id, 'target': parent_id, 'type': 'supports'})
+        return argument_id
+    
+    def flush(self) -> None:
+        """Add the buffered nodes and edges to the graph and clear the buffer"""
+        self.graph_builder._flush_buffer(self)
+        self.node_ids, self.names, self.node_types, self.edges = [], [], [], []
@@ -0,0 +1,28 @@
+"""Logging configuration module for non-blocking console output"""
+
+import atexit
+import logging
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+_listener: Optional[QueueListener] = None
+
+
+def configure_logging(level: int = logging.INFO) -> QueueListener:
+    """Route log records through a queue so workers never block on console I/O"""
+    global _listener
+    if _listener is not None:
+        return _listener
+    
+    log_queue = queue.Queue()
+    _listener = QueueListener(log_queue, logging.StreamHandler(sys.stdout))
+    _listener.start()
+    # Flush queued records on interpreter exit
+    atexit.register(_listener.stop)
+    
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(QueueHandler(log_queue))
+    return _listener
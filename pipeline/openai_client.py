@@ -1,72 +1,464 @@
 """OpenAI client module for handling API interactions"""
 
-from datetime import datetime, timedelta
+import asyncio
+import hashlib
+import importlib.util
+import logging
+import orjson
+import os
+import re
+from collections import OrderedDict
+from functools import lru_cache
 from dotenv import load_dotenv
-from openai import OpenAI
-import time
-from typing import Optional
+import httpx
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+from parallel_utils import RateLimiter
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+_shared_client: Optional[AsyncOpenAI] = None
+
+# Appended to user messages when neither they nor the instructions mention JSON, which JSON mode requires
+_JSON_HINT = "\n\nRespond with a JSON object."
+
+# JSON response wrapped in a markdown code fence
+_FENCE_RE = re.compile(r'\A```(?:json)?\n(.*?)\n```\s*\Z', re.DOTALL)
+
+try:
+    import tiktoken
+except ImportError:  # Fall back to a character-based estimate
+    tiktoken = None
+
+try:
+    import diskcache
+except ImportError:  # Responses are then only cached in memory
+    diskcache = None
+
+
+@lru_cache(maxsize=None)
+def _get_encoding(model: str):
+    """Get the tiktoken encoding for a model, cached per model"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding('o200k_base')
+
+
+def estimate_tokens(prompt: str, model: str) -> int:
+    """Estimate the number of tokens a prompt will consume"""
+    if tiktoken is None:
+        return len(prompt) // 4 + 1
+    return len(_get_encoding(model).encode(prompt))
+
+
+def get_shared_client() -> AsyncOpenAI:
+    """Get the process-wide AsyncOpenAI client, so all queries reuse one connection pool"""
+    global _shared_client
+    if _shared_client is None:
+        http_client = DefaultAsyncHttpxClient(
+            # HTTP/2 multiplexes concurrent requests over one TLS connection when h2 is installed
+            http2=importlib.util.find_spec('h2') is not None,
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=100)
+        )
+        _shared_client = AsyncOpenAI(http_client=http_client)
+    return _shared_client
+
+
+async def close_shared_client() -> None:
+    """Close the shared client's connection pool; the next get_shared_client() call creates a new one
+
+    Call before the event loop that used the client shuts down.
+    """
+    global _shared_client
+    if _shared_client is not None:
+        client, _shared_client = _shared_client, None
+        await client.close()
+
+
+def _spec_from_assistant(assistant) -> Dict[str, Any]:
+    """Extract the settings needed to reproduce an assistant's answers outside the Assistants API"""
+    response_format = assistant.response_format
+    if hasattr(response_format, 'to_dict'):
+        # API field names, e.g. json_schema.schema rather than the SDK's schema_
+        response_format = response_format.to_dict()
+    elif hasattr(response_format, 'model_dump'):
+        response_format = response_format.model_dump(by_alias=True, exclude_none=True)
+    return {
+        'model': assistant.model,
+        'instructions': assistant.instructions or '',
+        'temperature': assistant.temperature,
+        'top_p': assistant.top_p,
+        'response_format': response_format,
+        'tools': [tool.type for tool in assistant.tools or []]
+    }
+
+
+def _has_sdk_field_names(spec: Dict[str, Any]) -> bool:
+    """Whether a cached spec's response format was saved with SDK field names (schema_) instead of API ones"""
+    response_format = spec.get('response_format')
+    return (isinstance(response_format, dict)
+            and isinstance(response_format.get('json_schema'), dict)
+            and 'schema_' in response_format['json_schema'])
 
 
 class OpenAIClient:
-    """Handles OpenAI API interactions"""
-    
-    def __init__(self):
-        load_dotenv()
-        self.client = OpenAI()
-    
-    def query_assistant(self, assistant_id: str, prompt: str, timeout_seconds: int = 300) -> Optional[str]:
-        """Query an assistant and return the response"""
-        start_time = datetime.now()
-        
-        # Create a thread
-        thread = self.client.beta.threads.create()
-        
-        # Add message to thread
-        self.client.beta.threads.messages.create(
-            thread_id=thread.id,
-            role="user",
-            content=prompt
+    """Handles OpenAI API interactions asynchronously
+
+    Assistants are queried through Chat Completions with their model, instructions,
+    sampling parameters and response format. Assistants with tools (e.g. file_search)
+    are queried through a thread run instead, so their tools are still used.
+    """
+
+    def __init__(self, max_concurrent_requests: int = 32, rate_limiter: Optional[RateLimiter] = None,
+                 assistant_specs: Optional[Dict[str, Dict[str, Any]]] = None,
+                 response_cache_size: int = 1024, response_cache_dir: Optional[str] = None):
+        self.rate_limiter = rate_limiter
+        self._semaphore = asyncio.Semaphore(max_concurrent_requests)
+        # Assistant settings (see _spec_from_assistant) per assistant ID, shared with PipelineConfig.assistant_specs when given
+        self._assistants: Dict[str, Dict[str, Any]] = assistant_specs if assistant_specs is not None else {}
+        # In-flight retrievals, so concurrent first queries to an assistant share one request
+        self._pending_assistants: Dict[str, asyncio.Task] = {}
+        # Successful responses keyed by a hash of (assistant ID, prompt), least recently used first
+        self._responses: OrderedDict[bytes, str] = OrderedDict()
+        self._response_cache_size = response_cache_size
+        self._pending_responses: Dict[bytes, asyncio.Task] = {}
+        self._disk_cache = None
+        if response_cache_dir:
+            if diskcache is None:
+                logger.warning("diskcache is not installed; caching responses in memory only")
+            else:
+                self._disk_cache = diskcache.Cache(response_cache_dir)
+
+    @property
+    def client(self) -> AsyncOpenAI:
+        """The shared AsyncOpenAI client, recreated if it was closed"""
+        return get_shared_client()
+
+    async def load_assistants(self, assistant_ids: Iterable[str], cache_file: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """Fetch the settings of each assistant once, using an on-disk cache when available
+
+        Delete the cache file to pick up changes made to the assistants.
+        """
+        if cache_file and os.path.exists(cache_file):
+            with open(cache_file, 'rb') as f:
+                for assistant_id, spec in orjson.loads(f.read()).items():
+                    # Entries written before tools were recorded, or with SDK field names, are fetched again
+                    if 'tools' in spec and not _has_sdk_field_names(spec) and assistant_id not in self._assistants:
+                        self._register_assistant(assistant_id, spec)
+
+        missing = [assistant_id for assistant_id in assistant_ids if assistant_id not in self._assistants]
+        if missing:
+            await asyncio.gather(*[self._get_assistant(assistant_id) for assistant_id in missing])
+            if cache_file:
+                with open(cache_file, 'wb') as f:
+                    f.write(orjson.dumps(self._assistants, option=orjson.OPT_INDENT_2))
+
+        return self._assistants
+
+    async def query_assistant(self, assistant_id: str, prompt: str, timeout_seconds: int = 300) -> Optional[str]:
+        """Query an assistant's settings through Chat Completions and return the response
+
+        Identical queries are answered from the response cache, and concurrent
+        identical queries share one request. Error responses are not cached.
+        """
+        key = self._cache_key(assistant_id, prompt)
+        response = self._get_cached_response(key)
+        if response is not None:
+            return response
+
+        task = self._pending_responses.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._query_assistant(assistant_id, prompt, timeout_seconds))
+            self._pending_responses[key] = task
+        try:
+            # Shielded so one cancelled caller does not cancel the query for the others
+            response = await asyncio.shield(task)
+        finally:
+            if task.done():
+                self._pending_responses.pop(key, None)
+
+        if response is not None and not response.startswith("Error:"):
+            self._cache_response(key, response)
+        return response
+
+    async def _query_assistant(self, assistant_id: str, prompt: str, timeout_seconds: int) -> Optional[str]:
+        """Send one Chat Completions request, or a thread run for assistants with tools, for an assistant query"""
+        async with self._semaphore:
+            spec = await self._get_assistant(assistant_id)
+
+            # Wait for rate limit capacity first
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire_async(1, estimate_tokens(prompt, spec['model']))
+
+            if spec['tools']:
+                return await self._run_assistant(assistant_id, prompt, timeout_seconds)
+
+            try:
+                raw_response = await asyncio.wait_for(
+                    self.client.chat.completions.with_raw_response.create(**self._completion_request(spec, prompt)),
+                    timeout=timeout_seconds
+                )
+            except asyncio.TimeoutError:
+                return f"Error: Timeout after {timeout_seconds} seconds"
+
+            if self.rate_limiter is not None:
+                self.rate_limiter.update_from_headers(raw_response.headers)
+            choice = raw_response.parse().choices[0]
+
+            if choice.finish_reason == 'length':
+                return f"Error: Response truncated at max tokens"
+            elif choice.message.content is None:
+                return f"Error: Empty response (finish reason {choice.finish_reason})"
+
+            response_text = choice.message.content
+            logger.debug(response_text)
+            # JSON mode returns bare JSON; stripping guards against a fenced reply
+            return self._strip_markdown(response_text)
+
+    async def stream_assistant(self, assistant_id: str, prompt: str) -> AsyncIterator[str]:
+        """Query an assistant through a streamed Chat Completion and yield the response text as it arrives
+
+        Assistants with tools are answered by a thread run, yielded as one chunk.
+        """
+        async with self._semaphore:
+            spec = await self._get_assistant(assistant_id)
+
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire_async(1, estimate_tokens(prompt, spec['model']))
+
+            if spec['tools']:
+                response = await self._run_assistant(assistant_id, prompt)
+                if response.startswith("Error:"):
+                    raise RuntimeError(response)
+                yield response
+                return
+
+            stream = await self.client.chat.completions.create(**self._completion_request(spec, prompt), stream=True)
+            if self.rate_limiter is not None:
+                self.rate_limiter.update_from_headers(stream.response.headers)
+
+            async with stream:
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+
+    async def query_batch(self, prompts: List[Tuple[str, str]], timeout_seconds: int = 86400) -> List[Optional[str]]:
+        """Query assistants through the Batch API and return responses in prompt order
+
+        Each prompt is an (assistant_id, prompt) pair, sent as a Chat Completions
+        request with the assistant's settings. The Batch API cannot run assistant
+        tools, so prompts for assistants with tools are sent through query_assistant.
+        """
+        if not prompts:
+            return []
+
+        # Resolve every distinct assistant concurrently before building the batch
+        assistant_ids = list(dict.fromkeys(assistant_id for assistant_id, _ in prompts))
+        specs = dict(zip(assistant_ids, await asyncio.gather(
+            *[self._get_assistant(assistant_id) for assistant_id in assistant_ids]
+        )))
+
+        batch_indices = [i for i, (assistant_id, _) in enumerate(prompts) if not specs[assistant_id]['tools']]
+        run_indices = [i for i, (assistant_id, _) in enumerate(prompts) if specs[assistant_id]['tools']]
+        results: List[Optional[str]] = [f"Error: No batch result"] * len(prompts)
+        run_responses, batch_results = await asyncio.gather(
+            asyncio.gather(*[self.query_assistant(*prompts[i]) for i in run_indices]),
+            self._query_batch_api(prompts, specs, batch_indices, timeout_seconds)
+        )
+        for i, response in zip(run_indices, run_responses):
+            results[i] = response
+        for i, response in batch_results.items():
+            results[i] = response
+        return results
+
+    async def _query_batch_api(self, prompts: List[Tuple[str, str]], specs: Dict[str, Dict[str, Any]],
+                               indices: List[int], timeout_seconds: int) -> Dict[int, str]:
+        """Send the prompts at the given indices through the Batch API and return responses by index"""
+        if not indices:
+            return {}
+
+        # Build the JSONL batch input
+        lines = []
+        for i in indices:
+            assistant_id, prompt = prompts[i]
+            lines.append(orjson.dumps({
+                'custom_id': str(i),
+                'method': 'POST',
+                'url': '/v1/chat/completions',
+                'body': self._completion_request(specs[assistant_id], prompt)
+            }))
+
+        batch_file = await self.client.files.create(
+            file=('batch.jsonl', b'\n'.join(lines)),
+            purpose='batch'
         )
-        
-        # Run the assistant
-        run = self.client.beta.threads.runs.create(
-            thread_id=thread.id,
-            assistant_id=assistant_id
+        batch = await self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint='/v1/chat/completions',
+            completion_window='24h'
         )
-        
-        # Wait for completion with timeout
-        while run.status in ['queued', 'in_progress']:
-            if datetime.now() - start_time > timedelta(seconds=timeout_seconds):
-                return f"Error: Timeout after {timeout_seconds} seconds"
-            
-            time.sleep(1)
-            run = self.client.beta.threads.runs.retrieve(
-                thread_id=thread.id,
-                run_id=run.id
-            )
-        
-        if run.status == 'completed':
-            # Get messages
-            messages = self.client.beta.threads.messages.list(thread_id=thread.id)
-            response_text = messages.data[0].content[0].text.value
-            print(response_text)
-            
-            # Extract JSON from markdown code blocks if present
-            if response_text.startswith('```json'):
-                # Remove the opening and closing markdown code blocks
-                json_content = response_text.replace('```json\n', '').replace('\n```', '')
-                return json_content
-            elif response_text.startswith('```'):
-                # Handle case where it's just ``` without json specifier
-                json_content = response_text.replace('```\n', '').replace('\n```', '')
-                return json_content
+
+        # Wait for the batch to finish
+        try:
+            batch = await asyncio.wait_for(self._wait_for_batch(batch), timeout=timeout_seconds)
+        except asyncio.TimeoutError:
+            await self.client.batches.cancel(batch.id)
+            return {i: f"Error: Batch timeout after {timeout_seconds} seconds" for i in indices}
+
+        if batch.status != 'completed' or not batch.output_file_id:
+            return {i: f"Error: Batch status is {batch.status}" for i in indices}
+
+        # Download and map results back to prompt order
+        results: Dict[int, str] = {}
+        content = await self.client.files.content(batch.output_file_id)
+        for line in content.text.splitlines():
+            if not line.strip():
+                continue
+            result = orjson.loads(line)
+            index = int(result['custom_id'])
+            if result.get('error'):
+                results[index] = f"Error: Batch request failed - {result['error']}"
+                continue
+            choice = result['response']['body']['choices'][0]
+            if choice.get('finish_reason') == 'length':
+                results[index] = f"Error: Response truncated at max tokens"
+            elif choice['message'].get('content') is None:
+                results[index] = f"Error: Empty response (finish reason {choice.get('finish_reason')})"
             else:
-                return response_text
-        elif run.status == 'failed':
-            return f"Error: Run failed - {run.last_error}"
-        elif run.status == 'cancelled':
-            return f"Error: Run was cancelled"
-        elif run.status == 'expired':
-            return f"Error: Run expired"
-        else:
-            return f"Error: Run status is {run.status}"
+                results[index] = self._strip_markdown(choice['message']['content'])
+
+        return results
+
+    async def _wait_for_batch(self, batch):
+        """Poll a batch until it leaves the active states, backing off from 50ms by 1.5x up to 30s"""
+        delay = 0.05
+        while batch.status in ['validating', 'in_progress', 'finalizing']:
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.5, 30.0)
+            batch = await self.client.batches.retrieve(batch.id)
+        return batch
+
+    async def _run_assistant(self, assistant_id: str, prompt: str, timeout_seconds: int = 300) -> str:
+        """Query an assistant through a thread run, so its tools are used, and return the response"""
+        run = await self.client.beta.threads.create_and_run(
+            assistant_id=assistant_id,
+            thread={'messages': [{'role': 'user', 'content': prompt}]}
+        )
+        try:
+            run = await asyncio.wait_for(self._wait_for_run(run), timeout=timeout_seconds)
+        except asyncio.TimeoutError:
+            await self.client.beta.threads.runs.cancel(thread_id=run.thread_id, run_id=run.id)
+            return f"Error: Timeout after {timeout_seconds} seconds"
+
+        if run.status != 'completed':
+            return f"Error: Run status is {run.status}" + (f" - {run.last_error}" if run.last_error else '')
+
+        messages = await self.client.beta.threads.messages.list(thread_id=run.thread_id, order='desc', limit=1)
+        if not messages.data or not messages.data[0].content or messages.data[0].content[0].type != 'text':
+            return f"Error: Run returned no text response"
+        response_text = messages.data[0].content[0].text.value
+        logger.debug(response_text)
+        return self._strip_markdown(response_text)
+
+    async def _wait_for_run(self, run):
+        """Poll a run until it leaves the active states, backing off from 50ms by 1.5x up to 2s"""
+        delay = 0.05
+        while run.status in ['queued', 'in_progress', 'cancelling']:
+            await asyncio.sleep(delay)
+            delay = min(delay * 1.5, 2.0)
+            run = await self.client.beta.threads.runs.retrieve(thread_id=run.thread_id, run_id=run.id)
+        return run
+
+    @staticmethod
+    def _completion_request(spec: Dict[str, Any], prompt: str) -> Dict[str, Any]:
+        """Build Chat Completions parameters that reproduce an assistant's settings"""
+        response_format = spec.get('response_format')
+        if not isinstance(response_format, dict) or response_format.get('type') not in ('json_object', 'json_schema'):
+            # 'auto' and text formats are answered in JSON mode, since every response is parsed as JSON
+            response_format = {'type': 'json_object'}
+        if response_format['type'] == 'json_object' and 'json' not in (spec['instructions'] + prompt).lower():
+            prompt += _JSON_HINT
+
+        request = {
+            'model': spec['model'],
+            'messages': [
+                {'role': 'system', 'content': spec['instructions']},
+                {'role': 'user', 'content': prompt}
+            ],
+            'response_format': response_format
+        }
+        for param in ('temperature', 'top_p'):
+            if spec.get(param) is not None:
+                request[param] = spec[param]
+        return request
+
+    def _register_assistant(self, assistant_id: str, spec: Dict[str, Any]) -> None:
+        """Store an assistant's settings, warning when its tools force the slower thread-run path"""
+        if spec['tools']:
+            logger.warning(
+                f"Assistant {assistant_id} uses tools {spec['tools']}; it is queried through thread runs "
+                f"instead of Chat Completions so the tools are still used"
+            )
+        self._assistants[assistant_id] = spec
+
+    async def _get_assistant(self, assistant_id: str) -> Dict[str, Any]:
+        """Get the settings of an assistant, cached per assistant ID"""
+        if assistant_id in self._assistants:
+            return self._assistants[assistant_id]
+
+        task = self._pending_assistants.get(assistant_id)
+        if task is None:
+            task = asyncio.ensure_future(self.client.beta.assistants.retrieve(assistant_id))
+            self._pending_assistants[assistant_id] = task
+        try:
+            # Shielded so one cancelled caller does not cancel the retrieval for the others
+            assistant = await asyncio.shield(task)
+        finally:
+            if task.done():
+                self._pending_assistants.pop(assistant_id, None)
+
+        if assistant_id not in self._assistants:
+            self._register_assistant(assistant_id, _spec_from_assistant(assistant))
+        return self._assistants[assistant_id]
+
+    @staticmethod
+    def _cache_key(assistant_id: str, prompt: str) -> bytes:
+        """Hash (assistant ID, prompt) incrementally, without building a combined copy of the prompt"""
+        digest = hashlib.blake2b(assistant_id.encode('utf-8'), digest_size=16)
+        digest.update(b'\0')
+        digest.update(prompt.encode('utf-8'))
+        return digest.digest()
+
+    def _get_cached_response(self, key: bytes) -> Optional[str]:
+        """Look up a cached response in memory, then on disk"""
+        response = self._responses.get(key)
+        if response is not None:
+            self._responses.move_to_end(key)
+            return response
+        if self._disk_cache is not None:
+            response = self._disk_cache.get(key)
+            if response is not None:
+                self._cache_response(key, response, persist=False)
+        return response
+
+    def _cache_response(self, key: bytes, response: str, persist: bool = True) -> None:
+        """Store a response in the in-memory LRU and, if enabled, on disk"""
+        if self._response_cache_size > 0:
+            self._responses[key] = response
+            self._responses.move_to_end(key)
+            if len(self._responses) > self._response_cache_size:
+                self._responses.popitem(last=False)
+        if persist and self._disk_cache is not None:
+            self._disk_cache.set(key, response)
+
+    @staticmethod
+    def _strip_markdown(response_text: str) -> str:
+        """Extract JSON from markdown code blocks if present"""
+        # JSON mode almost always returns bare JSON, which never starts with a fence
+        if not response_text.startswith('```'):
+            return response_text
+        match = _FENCE_RE.match(response_text)
+        return match.group(1) if match else response_text
@@ -1,18 +1,71 @@
 """Output management module for handling file operations"""
 
-import json
+import orjson
 from datetime import datetime
-from typing import Dict, Any
+from typing import Any, Dict, List, Optional
+from graph_builder import GraphBuilder
 
 
 class OutputManager:
     """Handles output operations"""
     
     @staticmethod
-    def save_graph_data(graph_data: Dict[str, Any], output_dir: str = 'output'):
-        """Save graph data to JSON file"""
+    def _create_output_file(output_dir: str, prefix: str, extension: str):
+        """Create a new timestamped output file, adding a counter if the name is taken, and return (filename, file)"""
         timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        filename = f'{output_dir}/current_{timestamp}.json'
+        filename = f'{output_dir}/{prefix}_{timestamp}.{extension}'
+        counter = 0
+        while True:
+            try:
+                return filename, open(filename, 'xb')
+            except FileExistsError:
+                counter += 1
+                filename = f'{output_dir}/{prefix}_{timestamp}_{counter}.{extension}'
+    
+    @staticmethod
+    def save_graph_data(graph_builder: GraphBuilder, output_dir: str = 'output') -> str:
+        """Stream the graph builder's data to a new timestamped JSON file and return the file name"""
+        filename, f = OutputManager._create_output_file(output_dir, 'current', 'json')
+        with f:
+            graph_builder.stream_to(f)
+        return filename
+    
+    @staticmethod
+    def save_merge_log(merged_nodes: List[Dict[str, Any]], source_file: str, output_dir: str = 'output') -> str:
+        """Write a {"op": "source", "path": ...} line for the graph the merges apply to, then
+        one {"op": "merge", ...} JSON line per aggregation group, and return the file name
         
-        with open(filename, 'w') as f:
-            json.dump(graph_data, f)
+        Replaying the log on the source graph with load_merge_log and
+        GraphBuilder.aggregate_nodes reproduces the aggregation without
+        querying the assistant again.
+        """
+        filename, f = OutputManager._create_output_file(output_dir, 'merges', 'jsonl')
+        with f:
+            f.write(orjson.dumps({'op': 'source', 'path': source_file}))
+            f.write(b'\n')
+            for merge_info in merged_nodes:
+                f.write(orjson.dumps({
+                    'op': 'merge',
+                    'original_ids': list(merge_info.get('original_ids', [])),
+                    'new_argument': merge_info.get('new_argument', ''),
+                    'node_type': merge_info.get('node_type', 'supporting_argument')
+                }))
+                f.write(b'\n')
+        return filename
+    
+    @staticmethod
+    def load_merge_log(filename: str) -> List[Dict[str, Any]]:
+        """Read the merge groups recorded by save_merge_log"""
+        with open(filename, 'rb') as f:
+            entries = [orjson.loads(line) for line in f if line.strip()]
+        return [entry for entry in entries if entry.get('op') == 'merge']
+    
+    @staticmethod
+    def load_merge_source(filename: str) -> Optional[str]:
+        """Read the source graph path recorded by save_merge_log, or None for logs without one"""
+        with open(filename, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    entry = orjson.loads(line)
+                    return entry.get('path') if entry.get('op') == 'source' else None
+        return None
@@ -1,29 +1,103 @@
 """Utility module for advanced parallel processing features"""
 
+import asyncio
+import logging
 import time
+import threading
 import concurrent.futures
-from typing import List, Callable, Any, Dict, Iterator
+from typing import List, Callable, Any, Dict, Iterator, Mapping, Optional
 from functools import wraps
 
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Thread-safe token bucket tracking both requests and tokens per period
+    
+    Buckets refill continuously from a monotonic clock and can be corrected
+    with the remaining quota reported in OpenAI's x-ratelimit-* response headers.
+    """
+    
+    def __init__(self, max_requests: float = 500, max_tokens: float = 200000, period: float = 60.0):
+        self.max_requests = max_requests
+        self.max_tokens = max_tokens
+        self.period = period
+        self._requests_remaining = float(max_requests)
+        self._tokens_remaining = float(max_tokens)
+        self._last_refill = time.monotonic()
+        self._condition = threading.Condition()
+    
+    def acquire(self, requests: int = 1, tokens: int = 0):
+        """Block the calling thread until the requested capacity is available"""
+        with self._condition:
+            wait = self._reserve(requests, tokens)
+            while wait > 0:
+                self._condition.wait(wait)
+                wait = self._reserve(requests, tokens)
+    
+    async def acquire_async(self, requests: int = 1, tokens: int = 0):
+        """Wait without blocking the event loop until the requested capacity is available"""
+        while True:
+            with self._condition:
+                wait = self._reserve(requests, tokens)
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+    
+    def update_from_headers(self, headers: Mapping[str, str]):
+        """Overwrite the buckets with the remaining quota reported by the server"""
+        remaining_requests = headers.get('x-ratelimit-remaining-requests')
+        remaining_tokens = headers.get('x-ratelimit-remaining-tokens')
+        
+        with self._condition:
+            self._refill()
+            try:
+                if remaining_requests is not None:
+                    self._requests_remaining = float(remaining_requests)
+                if remaining_tokens is not None:
+                    self._tokens_remaining = float(remaining_tokens)
+            except ValueError:
+                return
+            self._condition.notify_all()
+    
+    def _refill(self):
+        """Refill both buckets for the time elapsed since the last refill (lock must be held)"""
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._requests_remaining = min(
+            self.max_requests,
+            self._requests_remaining + elapsed * self.max_requests / self.period
+        )
+        self._tokens_remaining = min(
+            self.max_tokens,
+            self._tokens_remaining + elapsed * self.max_tokens / self.period
+        )
+    
+    def _reserve(self, requests: int, tokens: int) -> float:
+        """Take capacity if available and return 0, otherwise return seconds to wait (lock must be held)"""
+        self._refill()
+        # A single oversized prompt must not wait forever for a bucket it can never fit in
+        tokens = min(tokens, self.max_tokens)
+        
+        if self._requests_remaining >= requests and self._tokens_remaining >= tokens:
+            self._requests_remaining -= requests
+            self._tokens_remaining -= tokens
+            return 0.0
+        
+        request_wait = (requests - self._requests_remaining) * self.period / self.max_requests
+        token_wait = (tokens - self._tokens_remaining) * self.period / self.max_tokens
+        return max(request_wait, token_wait, 0.01)
+
 
 def rate_limit(calls_per_second: int):
     """Decorator to rate limit function calls"""
     def decorator(func):
-        min_interval = 1.0 / calls_per_second
-        last_call_time = {}
+        limiter = RateLimiter(max_requests=calls_per_second, max_tokens=float('inf'), period=1.0)
         
         @wraps(func)
         def wrapper(*args, **kwargs):
-            current_time = time.time()
-            # Use function name as key for rate limiting
-            func_key = func.__name__
-            
-            if func_key in last_call_time:
-                time_since_last = current_time - last_call_time[func_key]
-                if time_since_last < min_interval:
-                    time.sleep(min_interval - time_since_last)
-            
-            last_call_time[func_key] = time.time()
+            limiter.acquire()
             return func(*args, **kwargs)
         
         return wrapper
@@ -39,102 +113,164 @@ class BatchProcessor:
     
     def process_batches(self, items: List[Any], process_func: Callable, 
                        batch_size: int = None) -> List[Any]:
-        """Process items in batches using parallel execution"""
-        batch_size = batch_size or self.batch_size
-        results = []
+        """Process items in batches using parallel execution
         
-        # Split items into batches
-        batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+        Results are aligned with items; failed items yield None.
+        """
+        batch_size = batch_size or self.batch_size
+        # Workers write straight into their slots, so no per-batch lists need flattening
+        results = [None] * len(items)
         
         with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
             # Submit batch processing tasks
-            future_to_batch = {
-                executor.submit(self._process_batch, batch, process_func): i 
-                for i, batch in enumerate(batches)
+            future_to_offset = {
+                executor.submit(self._process_batch, items, offset, min(offset + batch_size, len(items)),
+                                process_func, results): offset
+                for offset in range(0, len(items), batch_size)
             }
             
-            # Collect results in order
-            batch_results = [None] * len(batches)
-            for future in concurrent.futures.as_completed(future_to_batch):
-                batch_idx = future_to_batch[future]
+            for future in concurrent.futures.as_completed(future_to_offset):
                 try:
-                    batch_results[batch_idx] = future.result()
+                    future.result()
                 except Exception as exc:
-                    print(f"Batch {batch_idx} failed: {exc}")
-                    batch_results[batch_idx] = []
-            
-            # Flatten results
-            for batch_result in batch_results:
-                if batch_result:
-                    results.extend(batch_result)
+                    logger.error(f"Batch {future_to_offset[future] // batch_size} failed: {exc}")
         
         return results
     
-    def _process_batch(self, batch: List[Any], process_func: Callable) -> List[Any]:
-        """Process a single batch of items"""
-        results = []
-        for item in batch:
+    def _process_batch(self, items: List[Any], start: int, end: int, process_func: Callable,
+                       results: List[Any]) -> None:
+        """Process items[start:end], writing each result into the shared results list"""
+        for index in range(start, end):
             try:
-                result = process_func(item)
-                if result:
-                    results.append(result)
+                results[index] = process_func(items[index])
             except Exception as exc:
-                print(f"Item processing failed: {exc}")
-        return results
+                logger.error(f"Item processing failed: {exc}")
 
 
 class ProgressTracker:
-    """Track progress of parallel operations"""
+    """Track progress of parallel operations
+    
+    update() only bumps a counter; a background timer reports progress every
+    interval seconds until all items are done or stop() is called.
+    """
     
-    def __init__(self, total_items: int, description: str = "Processing"):
+    def __init__(self, total_items: int, description: str = "Processing", interval: float = 0.5):
         self.total_items = total_items
         self.description = description
         self.completed = 0
         self.start_time = time.time()
-        self._lock = concurrent.futures.threading.Lock()
+        self.interval = interval
+        self._last_reported = None
+        self._timer = None
+        self._timer_lock = threading.Lock()  # Guards only timer scheduling, never update()
+        self._stopped = False
+        self._schedule()
     
     def update(self, count: int = 1):
-        """Update progress count"""
-        with self._lock:
-            self.completed += count
+        """Update progress count (best effort under concurrent updates, no I/O)"""
+        self.completed += count
+        if self.completed >= self.total_items:
+            self.stop()
+    
+    def stop(self):
+        """Stop periodic reporting and report the final progress"""
+        with self._timer_lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            self._timer.cancel()
+        self._print_progress()
+    
+    def _schedule(self):
+        """Schedule the next periodic report"""
+        with self._timer_lock:
+            if self._stopped:
+                return
+            self._timer = threading.Timer(self.interval, self._tick)
+            self._timer.daemon = True
+            self._timer.start()
+    
+    def _tick(self):
+        """Report progress if it changed since the last report, then reschedule"""
+        completed = self.completed
+        if completed != self._last_reported:
             self._print_progress()
+        self._schedule()
     
     def _print_progress(self):
         """Print current progress"""
+        completed = self.completed
+        self._last_reported = completed
         elapsed = time.time() - self.start_time
-        if self.completed > 0:
-            rate = self.completed / elapsed
-            eta = (self.total_items - self.completed) / rate if rate > 0 else 0
-            print(f"{self.description}: {self.completed}/{self.total_items} "
-                  f"({self.completed/self.total_items*100:.1f}%) "
-                  f"[{elapsed:.1f}s, {rate:.2f} items/s, ETA: {eta:.1f}s]")
+        if completed > 0:
+            rate = completed / elapsed
+            eta = (self.total_items - completed) / rate if rate > 0 else 0
+            logger.info(f"{self.description}: {completed}/{self.total_items} "
+                        f"({completed/self.total_items*100:.1f}%) "
+                        f"[{elapsed:.1f}s, {rate:.2f} items/s, ETA: {eta:.1f}s]")
         else:
-            print(f"{self.description}: {self.completed}/{self.total_items} "
-                  f"({self.completed/self.total_items*100:.1f}%) [{elapsed:.1f}s]")
+            logger.info(f"{self.description}: {completed}/{self.total_items} "
+                        f"({completed/max(self.total_items, 1)*100:.1f}%) [{elapsed:.1f}s]")
 
 
-def parallel_map(func: Callable, items: List[Any], max_workers: int = 4, 
-                show_progress: bool = True) -> List[Any]:
-    """Parallel map function with progress tracking"""
+async def parallel_map_async(coro_func: Callable, items: List[Any], max_concurrent: int = 64,
+                             show_progress: bool = True,
+                             cost_fn: Optional[Callable[[Any], float]] = None) -> List[Any]:
+    """Concurrently await coro_func over items, preserving order, with progress tracking
+    
+    If cost_fn is given, the most expensive items are started first
+    (longest-processing-time-first) so long tasks don't trail at the end.
+    """
     if show_progress:
-        tracker = ProgressTracker(len(items), f"Executing {func.__name__}")
+        tracker = ProgressTracker(len(items), f"Executing {getattr(coro_func, '__name__', 'task')}")
     
+    semaphore = asyncio.Semaphore(max_concurrent)
     results = [None] * len(items)
     
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_index = {
-            executor.submit(func, item): i 
-            for i, item in enumerate(items)
-        }
-        
-        for future in concurrent.futures.as_completed(future_to_index):
-            index = future_to_index[future]
+    async def run(index: int) -> None:
+        # The semaphore admits waiters in FIFO order, so tasks start in dispatch order
+        async with semaphore:
             try:
-                results[index] = future.result()
-                if show_progress:
-                    tracker.update(1)
+                results[index] = await coro_func(items[index])
             except Exception as exc:
-                print(f"Item {index} failed: {exc}")
-                results[index] = None
+                logger.error(f"Item {index} failed: {exc}")
+                return
+        if show_progress:
+            tracker.update(1)
+    
+    order = range(len(items))
+    if cost_fn is not None:
+        order = sorted(order, key=lambda i: cost_fn(items[i]), reverse=True)
     
+    try:
+        await asyncio.gather(*[run(i) for i in order])
+    finally:
+        if show_progress:
+            tracker.stop()
     return results
+
+
+def parallel_map(func: Callable, items: List[Any], max_workers: int = 32, 
+                show_progress: bool = True,
+                cost_fn: Optional[Callable[[Any], float]] = None) -> List[Any]:
+    """Parallel map function with progress tracking
+    
+    Coroutine functions are awaited directly; plain functions run on a pool of
+    max_workers threads (work is assumed IO-bound, e.g. API calls). For prompt
+    strings, cost_fn=len starts the longest prompts first.
+    Must not be called from inside a running event loop (use parallel_map_async there).
+    """
+    async def run_all() -> List[Any]:
+        if asyncio.iscoroutinefunction(func):
+            return await parallel_map_async(func, items, max_workers, show_progress, cost_fn)
+        
+        loop = asyncio.get_running_loop()
+        # A pool per call, so a mapped function may itself call parallel_map without starving the outer call
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            @wraps(func)
+            async def coro_func(item):
+                return await loop.run_in_executor(executor, func, item)
+            
+            return await parallel_map_async(coro_func, items, max_workers, show_progress, cost_fn)
+    
+    return asyncio.run(run_all())
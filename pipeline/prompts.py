@@ -7,4 +7,65 @@ def GET_SUPPORTING_ARGUMENTS_PROMPT(argument, existing_arguments):
     return f'''
     Argument: {argument}
     Existing arguments: {existing_arguments}
-'''
\ No newline at end of file
+'''
+
+def GET_SUPPORTING_ARGUMENTS_BATCH_PROMPT(arguments, existing_arguments):
+    numbered_arguments = '\n'.join(
+        f'''
+    [{number}]
+    Argument: {argument}
+    Existing arguments not to reuse for this argument: {excluded_ids}'''
+        for number, (argument, excluded_ids) in enumerate(arguments, 1)
+    )
+    return f'''
+    Answer each numbered argument below separately, exactly as you would answer it on its own.
+    Return a JSON object of the form {{"results": [{{"argument_number": 1, "new_supporting_arguments": [...], "existing_supporting_arguments": [...]}}, ...]}}
+    with one entry per argument.
+    Existing arguments: {existing_arguments}
+{numbered_arguments}
+'''
+
+
+def GET_ARGUMENT_TREE_PROMPT(argument, existing_arguments, depth):
+    return f'''
+    Argument: {argument}
+    Existing arguments: {existing_arguments}
+    Return the full tree of supporting arguments, {depth} levels deep, as a JSON object of the form
+    {{"existing": ["id", ...], "arguments": [{{"argument": "...", "type": "argument", "existing": ["id", ...], "children": [...]}}, ...]}}
+    where children has the same form as arguments and existing lists the IDs of existing arguments that support
+    the argument above it. Only nodes of type "argument" have children or existing.
+'''
+
+
+_AGG_PROMPT_PREFIX = """You are a node aggregation assistant. Your task is to analyze the following nodes and identify which ones should be merged together based on semantic similarity and logical coherence.
+
+The nodes represent supporting arguments in a political discourse graph. Your goal is to consolidate similar or redundant arguments while maintaining the logical structure.
+
+Please analyze the following nodes and return a JSON response in this exact format:
+{
+  "merged_nodes": [
+    {
+      "original_ids": ["id1", "id4"],
+      "new_argument": "Ny sammenslått formulering",
+      "node_type": "argument"
+    }
+  ]
+}
+
+Guidelines:
+- Only merge nodes that are semantically similar or redundant
+- Each merged group should have at least 2 nodes
+- Provide a clear, concise new argument text that captures the essence of the merged nodes
+- Use the exact node IDs provided
+- Specify the node_type as "argument", "fact", or "value" based on the nature of the merged content
+- If no nodes should be merged, return an empty merged_nodes array
+
+Nodes to analyze:
+"""
+
+_AGG_PROMPT_SUFFIX = "\nPlease provide your response in the specified JSON format."
+
+
+def GET_AGGREGATION_PROMPT(nodes):
+    body = ''.join(f"- ID: {node['id']}, Content: {node['name']}\n" for node in nodes)
+    return f"{_AGG_PROMPT_PREFIX}{body}{_AGG_PROMPT_SUFFIX}"
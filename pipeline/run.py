@@ -2,10 +2,12 @@
 """Main entry point for running the pipeline"""
 
 from pipeline import Pipeline
+from logging_config import configure_logging
 
 
 def main():
     """Main entry point"""
+    configure_logging()
     pipeline = Pipeline()
     pipeline.run()
 
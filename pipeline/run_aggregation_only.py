@@ -1,61 +1,65 @@
 #!/usr/bin/env python3
 """Standalone script to run only the node aggregation step on existing output files"""
 
-import json
+import asyncio
+import logging
+import orjson
 import sys
 import os
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 
 # Add the current directory to the path so we can import our modules
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+import prompts
 from config import PipelineConfig
-from openai_client import OpenAIClient
-from graph_builder import GraphBuilder
+from openai_client import OpenAIClient, close_shared_client
+from graph_builder import GraphBuilder, has_merge_candidates
 from output_manager import OutputManager
+from data_processor import parse_aggregation_response
+from logging_config import configure_logging
+
+logger = logging.getLogger(__name__)
 
 
 def load_existing_graph(file_path: str) -> Dict[str, Any]:
     """Load graph data from an existing output file"""
     try:
-        with open(file_path, 'r') as f:
-            return json.load(f)
+        with open(file_path, 'rb') as f:
+            return orjson.loads(f.read())
     except FileNotFoundError:
-        print(f"Error: File {file_path} not found")
+        logger.error(f"Error: File {file_path} not found")
         sys.exit(1)
-    except json.JSONDecodeError:
-        print(f"Error: File {file_path} is not valid JSON")
+    except orjson.JSONDecodeError:
+        logger.error(f"Error: File {file_path} is not valid JSON")
         sys.exit(1)
 
 
 def populate_graph_builder(graph_builder: GraphBuilder, graph_data: Dict[str, Any]) -> None:
     """Populate the graph builder with existing graph data"""
-    # Clear any existing data
-    with graph_builder._lock:
-        graph_builder.nodes.clear()
-        graph_builder.edges.clear()
-        
-        # Add nodes
-        for node in graph_data.get('nodes', []):
-            graph_builder.nodes.append(node)
-        
-        # Add edges
-        for edge in graph_data.get('edges', []):
-            graph_builder.edges.append(edge)
+    # Replaces any existing data and rebuilds the graph builder's indexes
+    graph_builder.load_graph_data(graph_data)
 
 
-def run_aggregation_on_file(input_file: str, output_dir: str = 'output') -> None:
-    """Run aggregation on a specific input file and save to new output"""
-    print(f"=== Running Node Aggregation on {input_file} ===")
+async def run_aggregation_on_file(input_file: str, output_dir: str = 'output', merge_log: Optional[str] = None) -> None:
+    """Run aggregation on a specific input file and save to new output
+    
+    If merge_log is given, its recorded merges are replayed instead of querying the assistant.
+    """
+    logger.info(f"=== Running Node Aggregation on {input_file} ===")
     
     # Load the existing graph data
     graph_data = load_existing_graph(input_file)
-    print(f"Loaded graph with {len(graph_data.get('nodes', []))} nodes and {len(graph_data.get('edges', []))} edges")
+    logger.info(f"Loaded graph with {len(graph_data.get('nodes', []))} nodes and {len(graph_data.get('edges', []))} edges")
     
     # Initialize components
     config = PipelineConfig()
-    openai_client = OpenAIClient()
+    openai_client = OpenAIClient(
+        assistant_specs=config.assistant_specs,
+        response_cache_size=config.response_cache_size,
+        response_cache_dir=config.response_cache_dir
+    )
     graph_builder = GraphBuilder()
     output_manager = OutputManager()
     
@@ -64,89 +68,62 @@ def run_aggregation_on_file(input_file: str, output_dir: str = 'output') -> None
     
     # Get all nodes for aggregation
     nodes_for_aggregation = graph_builder.get_all_nodes_for_aggregation()
-    print(f"Found {len(nodes_for_aggregation)} nodes for potential aggregation...")
+    logger.info(f"Found {len(nodes_for_aggregation)} nodes for potential aggregation...")
     
     if len(nodes_for_aggregation) == 0:
-        print("No supporting argument nodes found. Nothing to aggregate.")
+        logger.info("No supporting argument nodes found. Nothing to aggregate.")
         return
     
-    # Prepare prompt for the assistant
-    prompt = create_aggregation_prompt(nodes_for_aggregation)
+    if merge_log is None and not has_merge_candidates(nodes_for_aggregation, config.aggregation_min_similarity):
+        logger.info("No merge candidates. Nothing to aggregate.")
+        return
     
-    # Query the assistant
     try:
-        print("Querying LLM assistant for node aggregation suggestions...")
-        response = openai_client.query_assistant(
-            assistant_id=config.assistant_ids['node_aggregator'],
-            prompt=prompt
-        )
-        
-        if response and not response.startswith('Error:'):
-            # Parse the response
-            try:
-                aggregation_data = json.loads(response)
-                merged_nodes = aggregation_data.get('merged_nodes', [])
-                
-                if merged_nodes:
-                    print(f"LLM suggested merging {len(merged_nodes)} groups of nodes...")
-                    
-                    # Apply the aggregation
-                    graph_builder.aggregate_nodes(merged_nodes)
-                    
-                    # Get updated stats
-                    stats = graph_builder.get_stats()
-                    print(f"After aggregation: {stats['total_nodes']} nodes, {stats['total_edges']} edges")
-                    
-                    # Save the updated graph
-                    updated_graph_data = graph_builder.get_graph_data()
-                    output_manager.save_graph_data(updated_graph_data, output_dir)
-                    print(f"Updated graph saved to {output_dir}/")
-                else:
-                    print("No node merging suggestions from LLM.")
-                    
-            except json.JSONDecodeError as e:
-                print(f"Failed to parse LLM response as JSON: {e}")
-                print(f"Raw response: {response}")
+        if merge_log is not None:
+            # Replay recorded merges
+            merged_nodes = output_manager.load_merge_log(merge_log)
+            source_file = output_manager.load_merge_source(merge_log)
+            if source_file is not None and os.path.abspath(source_file) != os.path.abspath(input_file):
+                logger.warning(f"Merge log {merge_log} was recorded on {source_file}, not {input_file}")
+            logger.info(f"Replaying {len(merged_nodes)} merges from {merge_log}...")
         else:
-            print(f"LLM assistant error: {response}")
+            # Prepare prompt for the assistant
+            prompt = prompts.GET_AGGREGATION_PROMPT(nodes_for_aggregation)
+            
+            # Query the assistant
+            await openai_client.load_assistants([config.assistant_ids['node_aggregator']], config.assistant_cache_file)
+            logger.info("Querying LLM assistant for node aggregation suggestions...")
+            response = await openai_client.query_assistant(
+                assistant_id=config.assistant_ids['node_aggregator'],
+                prompt=prompt
+            )
+            
+            # Parse the response
+            merged_nodes = parse_aggregation_response(response)
+        
+        if merged_nodes:
+            logger.info(f"LLM suggested merging {len(merged_nodes)} groups of nodes...")
+            
+            # Apply the aggregation
+            graph_builder.aggregate_nodes(merged_nodes)
+            
+            # Get updated stats
+            stats = graph_builder.get_stats()
+            logger.info(f"After aggregation: {stats['total_nodes']} nodes, {stats['total_edges']} edges")
+            
+            # Save the updated graph, and log new merges so they can be replayed
+            output_manager.save_graph_data(graph_builder, output_dir)
+            if merge_log is None:
+                merge_log = output_manager.save_merge_log(merged_nodes, input_file, output_dir)
+                logger.info(f"Merges logged to {merge_log}")
+            logger.info(f"Updated graph saved to {output_dir}/")
+        elif merged_nodes is not None:
+            logger.info("No node merging suggestions from LLM.")
             
     except Exception as e:
-        print(f"Error during node aggregation: {e}")
-
-
-def create_aggregation_prompt(nodes: List[Dict[str, Any]]) -> str:
-    """Create a prompt for the node aggregation assistant"""
-    prompt = """You are a node aggregation assistant. Your task is to analyze the following nodes and identify which ones should be merged together based on semantic similarity and logical coherence.
-
-The nodes represent supporting arguments in a political discourse graph. Your goal is to consolidate similar or redundant arguments while maintaining the logical structure.
-
-Please analyze the following nodes and return a JSON response in this exact format:
-{
-  "merged_nodes": [
-    {
-      "original_ids": ["id1", "id4"],
-      "new_argument": "Ny sammenslått formulering",
-      "node_type": "argument"
-    }
-  ]
-}
-
-Guidelines:
-- Only merge nodes that are semantically similar or redundant
-- Each merged group should have at least 2 nodes
-- Provide a clear, concise new argument text that captures the essence of the merged nodes
-- Use the exact node IDs provided
-- Specify the node_type as "argument", "fact", or "value" based on the nature of the merged content
-- If no nodes should be merged, return an empty merged_nodes array
-
-Nodes to analyze:
-"""
-    
-    for node in nodes:
-        prompt += f"- ID: {node['id']}, Content: {node['name']}\n"
-    
-    prompt += "\nPlease provide your response in the specified JSON format."
-    return prompt
+        logger.error(f"Error during node aggregation: {e}")
+    finally:
+        await close_shared_client()
 
 
 def list_available_files(output_dir: str = 'output') -> List[str]:
@@ -170,12 +147,19 @@ def list_available_files(output_dir: str = 'output') -> List[str]:
 
 def main():
     """Main entry point"""
+    configure_logging()
+    merge_log = None
     if len(sys.argv) > 1:
-        # Use command line argument as input file
+        # Use command line argument as input file, optionally followed by a merge log to replay
         input_file = sys.argv[1]
         if not os.path.exists(input_file):
             print(f"Error: File {input_file} not found")
             sys.exit(1)
+        if len(sys.argv) > 2:
+            merge_log = sys.argv[2]
+            if not os.path.exists(merge_log):
+                print(f"Error: File {merge_log} not found")
+                sys.exit(1)
     else:
         # Interactive mode - list available files and let user choose
         available_files = list_available_files()
@@ -202,8 +186,8 @@ def main():
             sys.exit(0)
     
     # Run aggregation
-    run_aggregation_on_file(input_file)
-    print("=== Aggregation Complete ===")
+    asyncio.run(run_aggregation_on_file(input_file, merge_log=merge_log))
+    logger.info("=== Aggregation Complete ===")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,6 @@
+"""Make the pipeline modules importable the way run.py imports them"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
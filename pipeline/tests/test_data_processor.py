@@ -0,0 +1,149 @@
+"""Tests for response parsing, validation and the streaming JSON parser"""
+
+import orjson
+
+from data_processor import (
+    StreamingJsonParser,
+    _valid_tree,
+    parse_aggregation_response,
+    parse_standpoints_response,
+    parse_supporting_arguments_batch_response,
+    parse_supporting_arguments_response
+)
+
+KEYS = ['new_supporting_arguments', 'existing_supporting_arguments']
+
+RESPONSE = {
+    'new_supporting_arguments': [
+        {'argument': 'Quoted "tax" with a \\ backslash and }]{[ brackets', 'type': 'fact'},
+        {'argument': 'Nested', 'type': 'argument', 'extra': [1, {'text': '}'}]}
+    ],
+    'other': ['ignored'],
+    'existing_supporting_arguments': ['id"1', 'id2']
+}
+
+EXPECTED = (
+    [('new_supporting_arguments', element) for element in RESPONSE['new_supporting_arguments']]
+    + [('existing_supporting_arguments', element) for element in RESPONSE['existing_supporting_arguments']]
+)
+
+
+def _feed_in_chunks(text, size):
+    parser = StreamingJsonParser(KEYS)
+    completed = []
+    longest_buffer = 0
+    for start in range(0, len(text), size):
+        completed.extend(parser.feed(text[start:start + size]))
+        longest_buffer = max(longest_buffer, len(parser._buffer))
+    return completed, longest_buffer
+
+
+def test_streaming_parser_handles_fenced_escaped_input_in_tiny_chunks():
+    text = '```json\n' + orjson.dumps(RESPONSE).decode() + '\n```'
+    longest_element = max(len(orjson.dumps(element)) for _, element in EXPECTED)
+    
+    for size in (1, 2, 3, 5, 8, len(text)):
+        completed, longest_buffer = _feed_in_chunks(text, size)
+        assert completed == EXPECTED
+        # Consumed text is dropped, so only the unfinished element is buffered
+        if size < len(text):
+            assert longest_buffer <= longest_element + size
+
+
+def test_streaming_parser_yields_elements_as_soon_as_they_complete():
+    parser = StreamingJsonParser(KEYS)
+    
+    assert parser.feed('{"new_supporting_arguments": [{"argument": "a", ') == []
+    assert parser.feed('"type": "fact"}, {"argument"') == [('new_supporting_arguments', {'argument': 'a', 'type': 'fact'})]
+    assert parser.feed(': "b", "type": "value"}]}') == [('new_supporting_arguments', {'argument': 'b', 'type': 'value'})]
+
+
+def test_supporting_arguments_response_skips_malformed_entries():
+    response = orjson.dumps({
+        'new_supporting_arguments': [
+            {'argument': 'ok', 'type': 'fact'},
+            {'argument': 'missing type'},
+            {'argument': '', 'type': 'fact'},
+            {'argument': 1, 'type': 'fact'},
+            'not an object'
+        ],
+        'existing_supporting_arguments': ['id1', 5, '', None]
+    }).decode()
+    
+    assert parse_supporting_arguments_response(response) == ([{'argument': 'ok', 'type': 'fact'}], ['id1'])
+
+
+def test_supporting_arguments_response_rejects_non_objects_and_errors():
+    assert parse_supporting_arguments_response('["not", "an", "object"]') is None
+    assert parse_supporting_arguments_response('not json') is None
+    assert parse_supporting_arguments_response('Error: timed out') is None
+    assert parse_supporting_arguments_response(None) is None
+    # Argument fields that are not lists are treated as empty
+    assert parse_supporting_arguments_response('{"new_supporting_arguments": "none"}') == ([], [])
+
+
+def test_batch_response_skips_out_of_range_argument_numbers():
+    response = orjson.dumps({'results': [
+        {'argument_number': 0, 'new_supporting_arguments': [{'argument': 'zero', 'type': 'fact'}]},
+        {'argument_number': 3, 'new_supporting_arguments': [{'argument': 'three', 'type': 'fact'}]},
+        {'argument_number': True, 'new_supporting_arguments': [{'argument': 'bool', 'type': 'fact'}]},
+        {'argument_number': '1', 'new_supporting_arguments': [{'argument': 'string', 'type': 'fact'}]},
+        {'argument_number': 2, 'new_supporting_arguments': [{'argument': 'two', 'type': 'fact'}],
+         'existing_supporting_arguments': ['id1']}
+    ]}).decode()
+    
+    assert parse_supporting_arguments_batch_response(response, 2) == [
+        None,
+        ([{'argument': 'two', 'type': 'fact'}], ['id1'])
+    ]
+
+
+def test_batch_response_without_results_list_fails_every_argument():
+    assert parse_supporting_arguments_batch_response('{"results": {}}', 3) == [None, None, None]
+    assert parse_supporting_arguments_batch_response('[]', 2) == [None, None]
+
+
+def test_valid_tree_keeps_well_formed_nodes_recursively():
+    tree = [
+        {'argument': 'root', 'type': 'argument', 'existing': ['id1', 2], 'children': [
+            {'argument': 'child fact', 'type': 'fact', 'children': [{'argument': 'dropped', 'type': 'fact'}]},
+            {'type': 'argument', 'children': [{'argument': 'lost with its parent', 'type': 'fact'}]},
+            {'argument': 'child', 'type': 'argument', 'children': 'not a list'}
+        ]},
+        'not an object'
+    ]
+    
+    assert _valid_tree(tree) == [
+        {'argument': 'root', 'type': 'argument', 'existing': ['id1'], 'children': [
+            {'argument': 'child fact', 'type': 'fact', 'existing': [], 'children': []},
+            {'argument': 'child', 'type': 'argument', 'existing': [], 'children': []}
+        ]}
+    ]
+    assert _valid_tree(None) == []
+    assert _valid_tree({'argument': 'a', 'type': 'fact'}) == []
+
+
+def test_standpoints_response_without_standpoints_list_is_empty():
+    assert parse_standpoints_response('{"standpoints": ["a", 1, "", "b"]}') == ['a', 'b']
+    assert parse_standpoints_response('{"other": []}') == []
+    assert parse_standpoints_response('["a"]') == []
+    assert parse_standpoints_response('Error: failed') == []
+
+
+def test_aggregation_response_drops_malformed_groups():
+    response = orjson.dumps({'merged_nodes': [
+        {'original_ids': ['a', 'b', 'a'], 'new_argument': 'merged'},
+        {'original_ids': ['a', 'a'], 'new_argument': 'one distinct ID'},
+        {'original_ids': ['a', 2], 'new_argument': 'non-string ID'},
+        {'original_ids': ['c', 'd'], 'new_argument': ''},
+        {'original_ids': ['c', 'd'], 'new_argument': 'bad type', 'node_type': 3},
+        {'original_ids': 'c', 'new_argument': 'not a list'},
+        'not an object'
+    ]}).decode()
+    
+    assert parse_aggregation_response(response) == [
+        {'original_ids': ['a', 'b'], 'new_argument': 'merged', 'node_type': 'supporting_argument'}
+    ]
+    assert parse_aggregation_response('{}') == []
+    assert parse_aggregation_response('["not an object"]') is None
+    assert parse_aggregation_response('{"merged_nodes": {}}') is None
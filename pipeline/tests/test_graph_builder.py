@@ -0,0 +1,88 @@
+"""Tests for GraphBuilder node storage and aggregation"""
+
+from graph_builder import GraphBuilder
+
+
+def _names(graph_builder):
+    return sorted(node['name'] for node in graph_builder.nodes)
+
+
+def _edge_names(graph_builder):
+    names = {node['id']: node['name'] for node in graph_builder.nodes}
+    return sorted((names[edge['source']], names[edge['target']]) for edge in graph_builder.edges)
+
+
+def _assert_consistent(graph_builder):
+    # The parallel arrays, the ID index and the per-type indexes all describe the same nodes
+    node_ids = graph_builder._node_ids
+    assert len(node_ids) == len(graph_builder._node_names) == len(graph_builder._node_types)
+    assert graph_builder._node_index == {node_id: i for i, node_id in enumerate(node_ids)}
+    for code, ids in graph_builder._ids_by_type.items():
+        assert graph_builder._type_counts[code] == len(ids)
+        assert all(graph_builder._node_types[graph_builder._node_index[node_id]] == code for node_id in ids)
+
+
+def _argument_graph():
+    graph_builder = GraphBuilder()
+    topic_id = graph_builder.add_topic('topic')
+    standpoint_id = graph_builder.add_standpoint('standpoint', topic_id)
+    ids = {}
+    for name in ('a', 'b', 'c', 'd'):
+        ids[name] = graph_builder.add_supporting_argument(name, 'argument', standpoint_id)
+    ids['a1'] = graph_builder.add_supporting_argument('a1', 'fact', ids['a'])
+    return graph_builder, ids
+
+
+def test_remove_node_swaps_last_node_into_place():
+    graph_builder, ids = _argument_graph()
+    
+    graph_builder._remove_node(ids['b'])
+    
+    assert _names(graph_builder) == ['a', 'a1', 'c', 'd', 'standpoint', 'topic']
+    # The last node took the removed node's slot
+    assert graph_builder._node_ids[graph_builder._node_index[ids['a1']]] == ids['a1']
+    _assert_consistent(graph_builder)
+
+
+def test_aggregate_nodes_rewires_edges_and_drops_self_loops():
+    graph_builder, ids = _argument_graph()
+    
+    graph_builder.aggregate_nodes([{'original_ids': [ids['a'], ids['a1']], 'new_argument': 'a+a1', 'node_type': 'argument'}])
+    
+    assert _names(graph_builder) == ['a+a1', 'b', 'c', 'd', 'standpoint', 'topic']
+    # a1 -> a became a loop on the merged node and is dropped
+    assert _edge_names(graph_builder) == [
+        ('a+a1', 'standpoint'), ('b', 'standpoint'), ('c', 'standpoint'), ('d', 'standpoint'), ('standpoint', 'topic')
+    ]
+    _assert_consistent(graph_builder)
+
+
+def test_aggregate_nodes_with_groups_sharing_a_node():
+    graph_builder, ids = _argument_graph()
+    
+    graph_builder.aggregate_nodes([
+        {'original_ids': [ids['a'], ids['b']], 'new_argument': 'a+b', 'node_type': 'argument'},
+        {'original_ids': [ids['b'], ids['c'], ids['d']], 'new_argument': 'c+d', 'node_type': 'argument'},
+        # Left with a single unmerged node, so skipped rather than creating a node without edges
+        {'original_ids': [ids['c'], ids['a1']], 'new_argument': 'skipped', 'node_type': 'fact'},
+        {'original_ids': ['unknown1', 'unknown2'], 'new_argument': 'unknown', 'node_type': 'fact'}
+    ])
+    
+    assert _names(graph_builder) == ['a+b', 'a1', 'c+d', 'standpoint', 'topic']
+    assert _edge_names(graph_builder) == [
+        ('a+b', 'standpoint'), ('a+b', 'standpoint'), ('a1', 'a+b'),
+        ('c+d', 'standpoint'), ('c+d', 'standpoint'), ('standpoint', 'topic')
+    ]
+    assert graph_builder.get_stats()['total_nodes'] == 5
+    _assert_consistent(graph_builder)
+
+
+def test_many_node_types_keep_arrays_in_sync():
+    graph_builder = GraphBuilder()
+    topic_id = graph_builder.add_topic('topic')
+    
+    for i in range(300):
+        graph_builder.add_supporting_argument(f'argument {i}', f'type {i}', topic_id)
+    
+    assert graph_builder.nodes[-1] == {'id': graph_builder._node_ids[-1], 'name': 'argument 299', 'type': 'type 299'}
+    _assert_consistent(graph_builder)
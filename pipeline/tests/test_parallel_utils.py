@@ -0,0 +1,152 @@
+"""Tests for parallel_map, parallel_map_async and RateLimiter"""
+
+import asyncio
+import time
+
+from parallel_utils import RateLimiter, parallel_map, parallel_map_async
+
+DELAY = 0.2
+ITEMS = 10
+
+
+def _slow_square(x):
+    time.sleep(DELAY)
+    return x * x
+
+
+async def _slow_square_async(x):
+    await asyncio.sleep(DELAY)
+    return x * x
+
+
+def test_parallel_map_preserves_order():
+    # Later items finish first, so results must be placed by index rather than completion order
+    def square_after(x):
+        time.sleep(0.01 * (ITEMS - x))
+        return x * x
+    
+    assert parallel_map(square_after, list(range(ITEMS)), show_progress=False) == [x * x for x in range(ITEMS)]
+
+
+def test_parallel_map_runs_concurrently():
+    start = time.monotonic()
+    results = parallel_map(_slow_square, list(range(ITEMS)), max_workers=ITEMS, show_progress=False)
+    elapsed = time.monotonic() - start
+    
+    assert results == [x * x for x in range(ITEMS)]
+    # Wall time is close to the slowest item, not the sum of all items
+    assert elapsed < DELAY * 3
+
+
+def test_parallel_map_awaits_coroutine_functions():
+    start = time.monotonic()
+    results = parallel_map(_slow_square_async, list(range(ITEMS)), show_progress=False)
+    
+    assert results == [x * x for x in range(ITEMS)]
+    assert time.monotonic() - start < DELAY * 3
+
+
+def test_parallel_map_cost_fn_keeps_result_order():
+    items = ['a', 'ccc', 'bb']
+    assert parallel_map(len, items, show_progress=False, cost_fn=len) == [1, 3, 2]
+
+
+def test_parallel_map_nested_does_not_deadlock():
+    def inner(x):
+        return sum(parallel_map(_slow_square, [x, x + 1], max_workers=2, show_progress=False))
+    
+    start = time.monotonic()
+    results = parallel_map(inner, [0, 2, 4], max_workers=2, show_progress=False)
+    
+    assert results == [1, 13, 41]
+    assert time.monotonic() - start < DELAY * 5
+
+
+def test_parallel_map_async_preserves_order_and_runs_concurrently():
+    async def delayed(x):
+        await asyncio.sleep(DELAY * (ITEMS - x) / ITEMS)
+        return x
+    
+    start = time.monotonic()
+    results = asyncio.run(parallel_map_async(delayed, list(range(ITEMS)), show_progress=False))
+    elapsed = time.monotonic() - start
+    
+    assert results == list(range(ITEMS))
+    assert elapsed < DELAY * 3
+
+
+def test_parallel_map_async_respects_max_concurrent():
+    running = 0
+    peak = 0
+    
+    async def track(x):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return x
+    
+    results = asyncio.run(parallel_map_async(track, list(range(ITEMS)), max_concurrent=3, show_progress=False))
+    
+    assert results == list(range(ITEMS))
+    assert peak == 3
+
+
+def test_parallel_map_async_failed_item_yields_none():
+    async def fail_on_odd(x):
+        if x % 2:
+            raise ValueError(x)
+        return x
+    
+    assert asyncio.run(parallel_map_async(fail_on_odd, [0, 1, 2, 3], show_progress=False)) == [0, None, 2, None]
+
+
+def test_rate_limiter_waits_for_refill_when_empty():
+    limiter = RateLimiter(max_requests=2, max_tokens=1000, period=0.4)
+    
+    start = time.monotonic()
+    limiter.acquire()
+    limiter.acquire()
+    assert time.monotonic() - start < 0.05
+    
+    # One request refills in period / max_requests
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.15
+
+
+def test_rate_limiter_acquire_async_waits_for_tokens():
+    limiter = RateLimiter(max_requests=100, max_tokens=100, period=0.4)
+    
+    async def acquire_twice():
+        await limiter.acquire_async(tokens=100)
+        await limiter.acquire_async(tokens=50)
+    
+    start = time.monotonic()
+    asyncio.run(acquire_twice())
+    # Half the token bucket refills in half the period
+    assert time.monotonic() - start >= 0.15
+
+
+def test_rate_limiter_caps_oversized_requests_at_bucket_size():
+    limiter = RateLimiter(max_requests=10, max_tokens=100, period=60.0)
+    
+    start = time.monotonic()
+    limiter.acquire(tokens=10000)
+    assert time.monotonic() - start < 0.05
+
+
+def test_rate_limiter_update_from_headers():
+    limiter = RateLimiter(max_requests=10, max_tokens=100, period=1.0)
+    
+    limiter.update_from_headers({'x-ratelimit-remaining-requests': '0', 'x-ratelimit-remaining-tokens': '40'})
+    assert limiter._requests_remaining == 0
+    assert limiter._tokens_remaining == 40
+    
+    # Malformed headers leave the buckets as they were
+    limiter.update_from_headers({'x-ratelimit-remaining-requests': 'many'})
+    assert limiter._requests_remaining < 1
+    
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.05